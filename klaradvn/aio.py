@@ -0,0 +1,205 @@
+import time
+import asyncio
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+import ollama
+
+from klaradvn.budget import generation_options
+from klaradvn.client import MODEL, ClientConfig, GenerationTimeout, retry_delay
+from klaradvn.extract import extract_class, extract_function_code
+from klaradvn.generate import STRUCTURED_TESTS_SCHEMA, assemble_structured_tests, build_prompt, extract_test_code, import_statement, prompt_hash, test_file_path
+from klaradvn.history import record_run
+from klaradvn.writer import merge_tests
+
+
+async def extract_function_code_async(folder_path: str, function_name: str) -> Optional[tuple[str, Path]]:
+    """Async counterpart of `extract_function_code`, the files are read and parsed in a worker thread."""
+
+    return await asyncio.to_thread(extract_function_code, folder_path, function_name)
+
+
+async def extract_class_async(folder: Path, class_name: str) -> Optional[Dict[str, Any]]:
+    """Async counterpart of `extract_class`, the modules are loaded in a worker thread."""
+
+    return await asyncio.to_thread(extract_class, folder, class_name)
+
+
+async def stream_test_code(code: str, structured: bool = False, report: Optional[Dict[str, Any]] = None, client_config: Optional[ClientConfig] = None, instructions: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Stream the response of the model for the given code, token by token.
+
+    Timeouts and retries follow `client_config` like the synchronous API. The
+    stream is aborted by cancelling the task that consumes it.
+
+    Args:
+        code: Source code of the function or class to test
+        structured: Constrain the model output to `STRUCTURED_TESTS_SCHEMA`
+        report: Optional dictionary that is filled with the generation metrics
+            once the stream is exhausted
+        client_config: Timeouts and retry settings for the ollama requests
+        instructions: Additional instructions appended to the prompt
+
+    Yields:
+        The pieces of the response as they are generated
+
+    Raises:
+        GenerationTimeout: If no token arrived in time
+    """
+
+    config = client_config or ClientConfig()
+    prompt = build_prompt(code, structured, instructions)
+    options = generation_options(code, structured)
+    kwargs = {'format': STRUCTURED_TESTS_SCHEMA if structured else None, 'options': options}
+    metrics = {'num_predict': options['num_predict'], 'time_to_first_token': None, 'prompt_hash': prompt_hash(structured)}
+    start = time.perf_counter()
+    for attempt in range(config.max_retries + 1):
+        received = False
+        try:
+            async for chunk in _stream_with_timeouts(prompt, config, kwargs):
+                received = True
+                if chunk['response'] and metrics['time_to_first_token'] is None:
+                    metrics['time_to_first_token'] = time.perf_counter() - start
+                if chunk['done']:
+                    metrics['prompt_tokens'] = chunk.get('prompt_eval_count')
+                    metrics['output_tokens'] = chunk.get('eval_count')
+                    metrics['done_reason'] = chunk.get('done_reason')
+                if chunk['response']:
+                    yield chunk['response']
+            break
+        except Exception as e:
+            delay = retry_delay(e, attempt, received, config)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+    metrics['total_latency'] = time.perf_counter() - start
+    if report is not None:
+        report.update(metrics)
+
+
+async def generate_test_code_async(code: str, structured: bool = False, report: Optional[Dict[str, Any]] = None, client_config: Optional[ClientConfig] = None, instructions: Optional[str] = None, on_token: Optional[Callable[[str], Any]] = None) -> str:
+    """
+    Async counterpart of `generate_test_code`, reporting progress through `on_token` instead of printing.
+
+    Args:
+        code: Source code of the function or class to test
+        structured: Constrain the model output to `STRUCTURED_TESTS_SCHEMA`
+        report: Optional dictionary that is filled with the generation metrics
+        client_config: Timeouts and retry settings for the ollama requests
+        instructions: Additional instructions appended to the prompt
+        on_token: Callback called with every piece of the response
+        history_path: SQLite database to record the run in, see `generate_tests`
+
+    Returns:
+        The generated test code
+
+    Raises:
+        GenerationTimeout: If no token arrived in time
+        ValueError: If a structured response cannot be assembled
+    """
+
+    response = ""
+    async for token in stream_test_code(code, structured, report, client_config, instructions):
+        response += token
+        if on_token is not None:
+            on_token(token)
+    if structured:
+        return assemble_structured_tests(response)
+    return extract_test_code(response)
+
+
+async def generate_tests_async(code_file: Path, code: str, function_name: str, structured: bool = False, report: Optional[Dict[str, Any]] = None, client_config: Optional[ClientConfig] = None, instructions: Optional[str] = None, replace_existing: bool = True, on_token: Optional[Callable[[str], Any]] = None, history_path: Optional[Path] = None) -> Tuple[bool, Path]:
+    """
+    Async counterpart of `generate_tests`; the test module is written in a worker thread.
+
+    Args:
+        code_file: Path to the Python file to generate tests for
+        code: Source code of the function or class to test
+        function_name: Name of the function or class to test
+        structured: Constrain the model output to `STRUCTURED_TESTS_SCHEMA`
+        report: Optional dictionary that is filled with the generation metrics,
+            the 'validation' result, the names and pytest node IDs of the
+            written tests and, with `history_path`, the 'run_id' of the run in
+            the history
+        client_config: Timeouts and retry settings for the ollama requests
+        instructions: Additional instructions appended to the prompt
+        replace_existing: Replace the generated tests of `function_name` in the test module
+        on_token: Callback called with every piece of the response
+        history_path: SQLite database to record the run in, see `generate_tests`
+
+    Returns:
+        Tuple of (success, output_file_path), success is False if ollama did
+        not respond or the generated code is not valid Python or contains no
+        tests, like `generate_tests`
+    """
+
+    output_file = test_file_path(code_file)
+    report = {} if report is None else report
+    validation = None
+    try:
+        test_code = await generate_test_code_async(code, structured, report, client_config, instructions, on_token)
+        test_code = import_statement(code_file, function_name) + test_code
+        tests = await asyncio.to_thread(merge_tests, output_file, test_code, function_name, replace_existing)
+        report['tests'] = tests
+        report['node_ids'] = [f"{output_file}::{name}" for name in tests]
+        validation = 'valid'
+    except (SyntaxError, ValueError):
+        validation = 'invalid'
+    except (TimeoutError, ConnectionError, ollama.ResponseError, httpx.TransportError) as e:
+        print(f"\nError generating tests for {function_name}: {e}")
+        validation = 'no response'
+    finally:
+        # Cancelled runs are not recorded
+        if validation is not None:
+            report['validation'] = validation
+            if history_path is not None:
+                report['run_id'] = await asyncio.to_thread(record_run, function_name, code, report, structured, history_path)
+    return validation == 'valid', output_file
+
+
+async def gather_tests_async(targets: Iterable[Tuple[Path, str, str]], concurrency: int = 4, **kwargs: Any) -> List[Any]:
+    """
+    Generate the tests of several functions or classes concurrently.
+
+    Args:
+        targets: Tuples of (code_file, code, function_name)
+        concurrency: Maximum number of generations running at the same time
+        **kwargs: Additional arguments for `generate_tests_async`
+
+    Returns:
+        The result of `generate_tests_async` per target, or the exception it raised
+    """
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def generate(code_file: Path, code: str, function_name: str) -> Tuple[bool, Path]:
+        async with semaphore:
+            return await generate_tests_async(code_file, code, function_name, **kwargs)
+
+    return await asyncio.gather(*(generate(*target) for target in targets), return_exceptions=True)
+
+
+async def _stream_with_timeouts(prompt: str, config: ClientConfig, kwargs: Dict[str, Any]) -> AsyncIterator[Any]:
+    """Read the ollama stream, bounding the wait for every chunk."""
+
+    timeout = httpx.Timeout(max(config.first_token_timeout, config.inter_token_timeout), connect=config.connect_timeout)
+    client = ollama.AsyncClient(host=config.host, timeout=timeout)
+    stream = None
+    try:
+        stream = await client.generate(model=MODEL, prompt=prompt, stream=True, **kwargs)
+        wait = config.first_token_timeout
+        while True:
+            try:
+                chunk = await asyncio.wait_for(anext(stream), wait)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                raise GenerationTimeout(f"No response from ollama within {wait:.0f}s") from None
+            yield chunk
+            wait = config.inter_token_timeout
+    finally:
+        if stream is not None:
+            await stream.aclose()
+        # AsyncClient.close() is not available in every supported ollama version
+        await client._client.aclose()
@@ -0,0 +1,76 @@
+import ast
+from typing import Any, Dict
+
+# Output-token budget: a fixed base plus an allowance per unit of complexity,
+# clamped so trivial code stays cheap and large classes cannot run away.
+BASE_TOKENS = 384
+TOKENS_PER_BRANCH = 96
+TOKENS_PER_PARAMETER = 32
+TOKENS_PER_METHOD = 256
+MIN_TOKENS = 256
+MAX_TOKENS = 4096
+
+# JSON escaping makes structured responses noticeably longer for the same tests
+STRUCTURED_OVERHEAD = 1.25
+
+# Stop when the chat template's end-of-turn tokens leak into the response, in
+# both modes. A closing fence is no stop sequence, as fences also end inside docstrings
+STOP_SEQUENCES = ["<|im_end|>", "<|endoftext|>"]
+
+BRANCH_NODES = (ast.If, ast.For, ast.AsyncFor, ast.While, ast.Try,
+                ast.IfExp, ast.BoolOp, ast.comprehension, ast.match_case, ast.ExceptHandler)
+
+
+def measure_complexity(code: str) -> Dict[str, int]:
+    """
+    Measure the size and complexity of extracted code.
+
+    Args:
+        code: Source code of a function or class
+
+    Returns:
+        Dictionary with the number of 'branches', 'parameters' and 'methods'.
+        Unparsable code counts as a single method without branches or parameters.
+    """
+
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return {'branches': 0, 'parameters': 0, 'methods': 1}
+
+    complexity = {'branches': 0, 'parameters': 0, 'methods': 0}
+    for node in ast.walk(tree):
+        if isinstance(node, BRANCH_NODES):
+            complexity['branches'] += 1
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            complexity['methods'] += 1
+            args = node.args
+            params = [*args.posonlyargs, *args.args, *args.kwonlyargs]
+            complexity['parameters'] += len([p for p in params if p.arg not in ('self', 'cls')])
+            complexity['parameters'] += int(args.vararg is not None) + int(args.kwarg is not None)
+    return complexity
+
+
+def generation_options(code: str, structured: bool = False) -> Dict[str, Any]:
+    """
+    Derive the ollama generation options for the given code.
+
+    Args:
+        code: Source code the tests are generated for
+        structured: Whether the structured-output mode is used
+
+    Returns:
+        Options dictionary with `num_predict` and `stop`
+    """
+
+    complexity = measure_complexity(code)
+    num_predict = (BASE_TOKENS
+                   + TOKENS_PER_BRANCH * complexity['branches']
+                   + TOKENS_PER_PARAMETER * complexity['parameters']
+                   + TOKENS_PER_METHOD * max(complexity['methods'] - 1, 0))
+    if structured:
+        num_predict = int(num_predict * STRUCTURED_OVERHEAD)
+    return {
+        'num_predict': min(max(num_predict, MIN_TOKENS), MAX_TOKENS),
+        'stop': STOP_SEQUENCES,
+    }
@@ -1,27 +1,107 @@
 from pathlib import Path
-import subprocess
 import os
 from typing import Annotated
 
+import ollama
 import typer
 
 from klaradvn.build_model import create_model
-from klaradvn.extract import extract_function_code
+from klaradvn.client import ClientConfig
+from klaradvn.coverage import improve_coverage
 from klaradvn.extract import extract_class
-from klaradvn.generate import generate_tests
+from klaradvn.extract import extract_symbols
+from klaradvn.extract import AmbiguousSymbolError, SymbolIndex
+from klaradvn.fanout import generate_class_tests
+from klaradvn.generate import generate_tests, test_file_path
+from klaradvn.history import HISTORY_FILE, PERCENTILES, load_runs, summarize_runs
+from klaradvn.mutate import score_tests
+from klaradvn.paths import CACHE_DIR
+from klaradvn.profiling import ProfileConfig, add_hook, configure, stage
+from klaradvn.retrieve import example_instructions, similar_tests
+from klaradvn.runner import verify_tests
+from klaradvn.sandbox import SandboxLimits
+from klaradvn.watch import watch_tree
+from klaradvn.writer import symbol_tests
 
 
-def test_class(class_: str):
-    result = extract_class(Path(os.getcwd()), class_)
-    success, test_path = generate_tests(Path(result['file_path']), result['source_code'], class_)
+def test_class(class_: str, structured: bool = False, client_config: ClientConfig = None, coverage_rounds: int = 0, per_method: bool = False, workers: int = 4, limits: SandboxLimits = None, on_slow: str = 'reject', examples: int = 0, example_tokens: int = 1024):
+    with stage('extract'):
+        symbol = resolve_symbol(class_, 'class')
+        result = extract_class(symbol['file_path'], symbol['name']) if symbol else None
+    if result is None:
+        raise ValueError(f"Could not find the class {class_}")
+    class_ = symbol['name']
+    report = {}
+    with stage('retrieve'):
+        instructions = retrieve_examples(result['source_code'], examples, example_tokens)
+    with stage('generate'):
+        if per_method:
+            success, test_path = generate_class_tests(Path(result['file_path']), result, class_, workers, structured, report, client_config, instructions, history_path())
+        else:
+            success, test_path = generate_tests(Path(result['file_path']), result['source_code'], class_, structured, report, client_config, instructions=instructions, history_path=history_path())
     if success:
-        subprocess.run([f"pytest {test_path} --noconftest"], shell=True)
+        with stage('verify'):
+            node_ids = verify_tests(report['node_ids'], result['source_code'], ['--noconftest'], limits, on_slow, report.get('run_id'), history_path())
+        if coverage_rounds:
+            with stage('coverage'):
+                improve_symbol_coverage(Path(result['file_path']), class_, node_ids, coverage_rounds, ['--noconftest'], limits, on_slow, structured=structured, client_config=client_config)
 
-def test_function(function: str):
-    code, path = extract_function_code(os.getcwd(), function)
-    success, test_path = generate_tests(path, code, function)
+def test_function(function: str, structured: bool = False, client_config: ClientConfig = None, coverage_rounds: int = 0, limits: SandboxLimits = None, on_slow: str = 'reject', examples: int = 0, example_tokens: int = 1024):
+    with stage('extract'):
+        symbol = resolve_symbol(function, 'function')
+    if symbol is None:
+        raise ValueError(f"Could not find the function {function}")
+    code, path, function = symbol['source_code'], symbol['file_path'], symbol['name']
+    report = {}
+    with stage('retrieve'):
+        instructions = retrieve_examples(code, examples, example_tokens)
+    with stage('generate'):
+        success, test_path = generate_tests(path, code, function, structured, report, client_config, instructions=instructions, history_path=history_path())
     if success:
-        subprocess.run([f"pytest {test_path}"], shell=True)
+        with stage('verify'):
+            node_ids = verify_tests(report['node_ids'], code, [], limits, on_slow, report.get('run_id'), history_path())
+        if coverage_rounds:
+            with stage('coverage'):
+                improve_symbol_coverage(path, function, node_ids, coverage_rounds, [], limits, on_slow, structured=structured, client_config=client_config)
+
+def history_path() -> Path:
+    """Path of the run history of the project in the current directory."""
+    return Path(os.getcwd()) / CACHE_DIR / HISTORY_FILE
+
+def resolve_symbol(name: str, kind: str) -> dict | None:
+    """Look up a function or class in the current directory, printing the qualified names to choose from when the name is ambiguous."""
+    try:
+        return SymbolIndex(Path(os.getcwd()), Path(os.getcwd()) / CACHE_DIR).resolve(name, kind=kind)
+    except AmbiguousSymbolError as e:
+        print(f"More than one {kind} is named '{e.name}', use one of the qualified names:")
+        for candidate in e.candidates:
+            print(f"  {candidate}")
+        raise typer.Exit(1)
+
+def retrieve_examples(code: str, k: int, token_budget: int) -> str | None:
+    """Find the existing tests most similar to the code and return them as prompt instructions."""
+    if k <= 0:
+        return None
+    try:
+        examples = similar_tests(code, Path(os.getcwd()), k, token_budget)
+    except (ConnectionError, ollama.ResponseError) as e:
+        print(f"Generating without example tests, the test index could not be updated: {e}")
+        return None
+    print(f"Using {len(examples)} existing tests as examples")
+    return example_instructions(examples)
+
+def print_stage(name: str, report: dict):
+    """Print the duration of a stage and where its profiling report was written."""
+    print(f"Stage {name} took {report['duration']:.2f}s" + (f", report written to {report['report']}" if 'report' in report else ""))
+
+def enable_profiling(profile: bool, trace_memory: bool):
+    if profile or trace_memory:
+        configure(ProfileConfig(profile=profile, trace_memory=trace_memory))
+        add_hook(print_stage)
+
+def improve_symbol_coverage(path: Path, name: str, node_ids: list[str], rounds: int, extra_args: list[str], limits: SandboxLimits, on_slow: str, **kwargs):
+    symbol = extract_symbols(path, nested=True)[name]
+    improve_coverage(path, name, symbol['source_code'], symbol['lineno'], node_ids, rounds, extra_args, limits, on_slow, history_path(), **kwargs)
 
 
 app = typer.Typer()
@@ -32,16 +112,101 @@ def create_model():
     create_model()
 
 @app.command()
-def test(name: str, class_: Annotated[bool, typer.Option("--class", "-c")] = False, function_: Annotated[bool, typer.Option("--function", '-f')] = False):
+def test(name: str, class_: Annotated[bool, typer.Option("--class", "-c")] = False, function_: Annotated[bool, typer.Option("--function", '-f')] = False, structured: Annotated[bool, typer.Option("--structured", "-s", help="Let the model return the tests as JSON instead of free text")] = False,
+         connect_timeout: Annotated[float, typer.Option(help="Seconds to wait for the connection to the ollama daemon")] = ClientConfig.connect_timeout,
+         first_token_timeout: Annotated[float, typer.Option(help="Seconds to wait for the first token, including model loading")] = ClientConfig.first_token_timeout,
+         inter_token_timeout: Annotated[float, typer.Option(help="Seconds to wait between two tokens")] = ClientConfig.inter_token_timeout,
+         retries: Annotated[int, typer.Option(help="Number of retries for transient ollama failures")] = ClientConfig.max_retries,
+         coverage_rounds: Annotated[int, typer.Option(help="Number of follow-up generations for the lines the tests do not cover")] = 0,
+         per_method: Annotated[bool, typer.Option("--per-method", help="Generate the tests of a class per method, concurrently")] = False,
+         workers: Annotated[int, typer.Option(help="Number of concurrent generations with --per-method")] = 4,
+         test_timeout: Annotated[float, typer.Option(help="Seconds after which the test run is killed")] = SandboxLimits.timeout,
+         memory_limit: Annotated[int, typer.Option(help="Memory limit of the test run in MiB")] = SandboxLimits.memory_mb,
+         test_budget: Annotated[float, typer.Option(help="Seconds above which a single test is slow")] = SandboxLimits.test_budget,
+         on_slow: Annotated[str, typer.Option(help="Either `reject` (remove) or `mark` (with @pytest.mark.slow) slow tests")] = 'reject',
+         examples: Annotated[int, typer.Option(help="Number of similar existing tests to show the model as examples, 0 to disable")] = 3,
+         example_tokens: Annotated[int, typer.Option(help="Maximum number of tokens of all examples together")] = 1024,
+         profile: Annotated[bool, typer.Option("--profile", help="Profile every stage with cProfile and write the hot spots to .klaradvn/profiles")] = False,
+         trace_memory: Annotated[bool, typer.Option("--trace-memory", help="Trace the memory allocations of every stage with tracemalloc")] = False):
     """Command to create the tests for your code. Either the `class` or the `function` option should be provided!"""
     if not class_ and not function_:
         raise ValueError("Either the class option or function option should be provided. You provided nothing.")
     if class_ and function_:
         raise ValueError("Either the class option or function option should be provided. You provided both.")
-    if class_:
-        test_class(name)
-    if function_:
-        test_function(name)
+    client_config = ClientConfig(connect_timeout=connect_timeout, first_token_timeout=first_token_timeout, inter_token_timeout=inter_token_timeout, max_retries=retries)
+    limits = SandboxLimits(timeout=test_timeout, memory_mb=memory_limit, test_budget=test_budget)
+    enable_profiling(profile, trace_memory)
+    try:
+        if class_:
+            test_class(name, structured, client_config, coverage_rounds, per_method, workers, limits, on_slow, examples, example_tokens)
+        if function_:
+            test_function(name, structured, client_config, coverage_rounds, limits, on_slow, examples, example_tokens)
+    except KeyboardInterrupt:
+        raise typer.Exit(130)
+
+@app.command()
+def extract(name: str, class_: Annotated[bool, typer.Option("--class", "-c")] = False,
+            profile: Annotated[bool, typer.Option("--profile", help="Profile the extraction with cProfile and write the hot spots to .klaradvn/profiles")] = False,
+            trace_memory: Annotated[bool, typer.Option("--trace-memory", help="Trace the memory allocations of the extraction with tracemalloc")] = False):
+    """Command that prints the code Klara finds for a function or class, use it with --profile or --trace-memory to diagnose slow extractions."""
+    enable_profiling(profile, trace_memory)
+    with stage('extract'):
+        if class_:
+            result = extract_class(Path(os.getcwd()), name)
+            code, path = (result['source_code'], result['file_path']) if result else (None, None)
+        else:
+            symbol = resolve_symbol(name, 'function')
+            code, path = (symbol['source_code'], symbol['file_path']) if symbol else (None, None)
+    if code is None:
+        raise ValueError(f"Could not find {name}")
+    print(f"# {path}\n{code}")
+
+@app.command()
+def score(name: str, class_: Annotated[bool, typer.Option("--class", "-c")] = False,
+          timeout: Annotated[float, typer.Option(help="Seconds after which a mutant's test run is aborted")] = 10.0,
+          workers: Annotated[int, typer.Option(help="Number of concurrent workers, defaults to the number of CPUs")] = None):
+    """Command that scores the generated tests of a function or class by the fraction of code mutants they detect."""
+    symbol = resolve_symbol(name, 'class' if class_ else 'function')
+    if symbol is None:
+        raise ValueError(f"Could not find {name}")
+    path, name = symbol['file_path'], symbol['name']
+    test_path = test_file_path(path)
+    node_ids = [f"{test_path}::{test}" for test in symbol_tests(test_path, name)]
+    if not node_ids:
+        raise ValueError(f"No tests for {name} found in {test_path}, create them with `klara test` first")
+    score_tests(path, symbol['lineno'], symbol['end_lineno'], node_ids, timeout, workers, ['--noconftest'] if class_ else [])
+
+@app.command()
+def report(symbol: Annotated[str, typer.Option(help="Only report the runs of this function or class")] = None,
+           window: Annotated[int, typer.Option(help="Number of most recent runs to report")] = 20,
+           baseline: Annotated[int, typer.Option(help="Number of runs before the recent runs to compare with")] = 100,
+           threshold: Annotated[float, typer.Option(help="Relative change of the median that is flagged as a regression")] = 0.2):
+    """Command that summarizes the recorded generation runs and flags regressions against the runs before them."""
+    runs = load_runs(history_path(), symbol=symbol)
+    if not runs:
+        print("No runs recorded yet, generate tests with `klara test` first")
+        return
+    summary = summarize_runs(runs, window, baseline, threshold)
+    recent, base = min(window, len(runs)), max(0, min(baseline, len(runs) - window))
+    print(f"{len(runs)} runs recorded, comparing the last {recent} runs with the {base} runs before them\n")
+    columns = [f"p{q}" for q in PERCENTILES]
+    print(f"{'metric':<22}" + "".join(f"{c:>10}" for c in columns) + f"{'baseline p50':>14}")
+    for metric, values in summary.items():
+        cells = "".join(f"{format_value(values['recent'].get(c)):>10}" for c in columns)
+        flag = "  REGRESSION" if values['regressed'] else ""
+        print(f"{metric:<22}{cells}{format_value(values['baseline']['p50']):>14}{flag}")
+    if any(values['regressed'] for values in summary.values()):
+        raise typer.Exit(1)
+
+def format_value(value: float | None) -> str:
+    return "-" if value is None else f"{value:.2f}"
+
+@app.command()
+def watch(path: Annotated[Path, typer.Argument(help="Source tree to watch")] = Path('.'),
+          debounce: Annotated[float, typer.Option(help="Seconds without changes before the changes are processed")] = 0.5,
+          poll: Annotated[bool, typer.Option("--poll", help="Poll for changes instead of using inotify")] = False):
+    """Command that keeps the tests up to date by regenerating them for every function or class you edit."""
+    watch_tree(path, debounce, poll)
 
 if __name__ == "__main__":
     app()
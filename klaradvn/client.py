@@ -0,0 +1,221 @@
+import queue
+import time
+import socket
+import random
+import threading
+from dataclasses import dataclass
+from typing import Any, Iterator, Optional
+
+import httpx
+import ollama
+
+MODEL = 'klaradvn:latest'
+
+# HTTP status codes returned by ollama that are worth retrying
+TRANSIENT_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Interval in seconds at which a waiting stream checks for cancellation
+POLL_INTERVAL = 0.1
+
+
+@dataclass
+class ClientConfig:
+    """
+    Timeouts and retry behaviour of the requests to the ollama daemon.
+
+    All durations are in seconds. The first-token timeout includes loading the
+    model into memory, which can take minutes on a cold start on CPU.
+    """
+
+    host: Optional[str] = None
+    connect_timeout: float = 10.0
+    first_token_timeout: float = 300.0
+    inter_token_timeout: float = 60.0
+    max_retries: int = 3
+    backoff_base: float = 1.0
+    backoff_max: float = 30.0
+
+
+class GenerationTimeout(TimeoutError):
+    """Raised when the ollama daemon does not produce a token in time."""
+
+
+class GenerationCancelled(Exception):
+    """Raised when a generation is cancelled through its cancel event."""
+
+
+def backoff_delay(attempt: int, config: ClientConfig) -> float:
+    """Return the 'full jitter' exponential backoff delay for a retry attempt."""
+
+    return random.uniform(0, min(config.backoff_max, config.backoff_base * 2 ** attempt))
+
+
+def is_transient(error: BaseException) -> bool:
+    """
+    Check whether a failed request is worth retrying.
+
+    A first-token timeout is not: the daemon is busy or still loading the model,
+    and a retry would only queue up behind the requests keeping it busy.
+    """
+
+    if isinstance(error, ollama.ResponseError):
+        return error.status_code in TRANSIENT_STATUS_CODES
+    if isinstance(error, GenerationTimeout):
+        return False
+    return isinstance(error, (ConnectionError, httpx.TransportError))
+
+
+def retry_delay(error: BaseException, attempt: int, received: bool, config: ClientConfig) -> Optional[float]:
+    """
+    Decide whether a failed request is retried, shared by the sync and the async API.
+
+    Args:
+        error: Error the request failed with
+        attempt: Number of the failed attempt, starting at 0
+        received: Whether a chunk of the response was received before the failure
+        config: Retry settings
+
+    Returns:
+        The delay in seconds before the next attempt, None if the error must be raised
+    """
+
+    if received or not is_transient(error) or attempt == config.max_retries:
+        return None
+    return backoff_delay(attempt, config)
+
+
+def stream_generate(prompt: str, config: Optional[ClientConfig] = None, cancel_event: Optional[threading.Event] = None, **kwargs: Any) -> Iterator[Any]:
+    """
+    Stream a generation from the klaradvn model with timeouts and retries.
+
+    A request is only retried when it failed before the first chunk was
+    received, so the caller never sees a response twice, and never after a
+    timeout, see `is_transient`.
+
+    Args:
+        prompt: Prompt to send to the model
+        config: Timeouts and retry settings, defaults to `ClientConfig()`
+        cancel_event: Event that aborts the stream (and pending retries) when set
+        **kwargs: Additional arguments for `ollama.Client.generate`
+
+    Yields:
+        The response chunks of the model
+
+    Raises:
+        GenerationTimeout: If no token arrived in time
+        GenerationCancelled: If `cancel_event` was set
+    """
+
+    config = config or ClientConfig()
+    cancel_event = cancel_event or threading.Event()
+    for attempt in range(config.max_retries + 1):
+        received = False
+        try:
+            for chunk in _stream_with_timeouts(prompt, config, cancel_event, kwargs):
+                received = True
+                yield chunk
+            return
+        except Exception as e:
+            delay = retry_delay(e, attempt, received, config)
+            if delay is None:
+                raise
+            print(f"\nRequest to ollama failed ({e}), retrying in {delay:.1f}s...")
+            if cancel_event.wait(delay):
+                raise GenerationCancelled("Generation was cancelled") from None
+
+
+_DONE = object()
+
+
+def _stream_with_timeouts(prompt: str, config: ClientConfig, cancel_event: threading.Event, kwargs: dict) -> Iterator[Any]:
+    """
+    Read the ollama stream on a worker thread so every wait can be bounded.
+
+    The first-token and inter-token timeouts are enforced here. When the wait
+    ends early the connection is shut down underneath the worker thread, which
+    interrupts its blocked read and makes ollama drop the request; the HTTP
+    read timeout only acts as a backstop.
+    """
+
+    timeout = httpx.Timeout(max(config.first_token_timeout, config.inter_token_timeout), connect=config.connect_timeout)
+    connections = []
+
+    def trace(event_name, info):
+        if event_name == 'connection.connect_tcp.complete':
+            connections.append(info['return_value'])
+
+    def add_trace(request):
+        # The connection is needed before the response headers arrive, which
+        # ollama only sends once the model started generating
+        request.extensions['trace'] = trace
+
+    client = ollama.Client(host=config.host, timeout=timeout, event_hooks={'request': [add_trace]})
+    chunks = queue.Queue()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            stream = client.generate(model=MODEL, prompt=prompt, stream=True, **kwargs)
+            try:
+                for chunk in stream:
+                    if stop.is_set():
+                        break
+                    chunks.put(chunk)
+            finally:
+                # Closing the generator closes the HTTP response as well
+                stream.close()
+        except Exception as e:
+            chunks.put(e)
+        finally:
+            chunks.put(_DONE)
+            # Release the connection pool, Client.close() is not available in every supported ollama version
+            client._client.close()
+
+    threading.Thread(target=produce, name="klaradvn-stream", daemon=True).start()
+
+    wait = config.first_token_timeout
+    try:
+        while True:
+            item = _next_item(chunks, wait, cancel_event)
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+            wait = config.inter_token_timeout
+    finally:
+        stop.set()
+        for connection in connections:
+            _shutdown(connection)
+
+
+def _shutdown(network_stream: Any) -> None:
+    """
+    Shut down the socket of a connection that is read on another thread.
+
+    Closing the socket does not wake a thread blocked reading from it, shutting
+    it down does, and ollama stops generating once the connection is gone.
+    """
+
+    sock = network_stream.get_extra_info('socket')
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        # Already closed by the worker thread
+        pass
+
+
+def _next_item(chunks: queue.Queue, timeout: float, cancel_event: threading.Event) -> Any:
+    """Wait for the next item of the stream while watching the cancel event."""
+
+    deadline = time.monotonic() + timeout
+    while (remaining := deadline - time.monotonic()) > 0:
+        if cancel_event.is_set():
+            raise GenerationCancelled("Generation was cancelled")
+        try:
+            return chunks.get(timeout=min(POLL_INTERVAL, remaining))
+        except queue.Empty:
+            continue
+    raise GenerationTimeout(f"No response from ollama within {timeout:.0f}s")
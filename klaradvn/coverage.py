@@ -0,0 +1,259 @@
+import os
+import ast
+import sys
+import json
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from klaradvn.generate import generate_tests
+from klaradvn.history import record_run
+from klaradvn.runner import verify_tests
+from klaradvn.sandbox import SandboxLimits, run_sandboxed
+
+BRANCH_NODES = (ast.If, ast.For, ast.AsyncFor, ast.While)
+
+FOLLOW_UP_INSTRUCTIONS = """
+Lines marked with `# NOT COVERED` are not executed by the existing tests.
+Only write tests that execute these lines, do not repeat tests for the rest of the code.
+"""
+
+
+def measure_coverage(node_ids: List[str], file_path: Path, lineno: int, end_lineno: int, extra_args: Sequence[str] = (), limits: Optional[SandboxLimits] = None) -> Dict[str, Any]:
+    """
+    Measure the line and branch coverage of a line span while running tests.
+
+    The tests run in a sandboxed pytest subprocess that only traces the target
+    file, using `sys.monitoring` on Python 3.12+ and `sys.settrace` on older
+    versions. Nothing counts as covered when the run is killed.
+
+    Args:
+        node_ids: pytest node IDs of the tests to run
+        file_path: Python file containing the function or class under test
+        lineno: First line of the function or class (1-indexed)
+        end_lineno: Last line of the function or class
+        extra_args: Additional command line arguments for pytest
+        limits: Resource limits of the sandbox, defaults to `SandboxLimits()`
+
+    Returns:
+        Dictionary with:
+        - 'lines' and 'missing_lines': Executable and not executed line numbers
+        - 'branches' and 'missing_branches': Number of branch outcomes and the
+          lines of branches of which not every outcome was taken
+        - 'line_rate' and 'branch_rate': Covered fraction between 0 and 1
+        - 'timed_out': Whether the run was killed after the timeout
+    """
+
+    file_path = Path(file_path).resolve()
+    lines = _executable_lines(file_path, lineno, end_lineno)
+    branch_lines = _branch_lines(file_path, lineno, end_lineno)
+
+    fd, output = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        run = run_sandboxed([sys.executable, '-m', 'klaradvn.coverage', output, str(file_path), str(lineno), str(end_lineno), '--', *node_ids, *extra_args], limits, os.getcwd())
+        if run['timed_out']:
+            print(f"Coverage run was killed after {limits.timeout if limits else SandboxLimits.timeout:.0f}s")
+        try:
+            data = json.loads(Path(output).read_text(encoding='utf-8') or '{}')
+        except ValueError:
+            data = {}
+    finally:
+        os.unlink(output)
+
+    executed = set(data.get('lines', []))
+    destinations = {line: set() for line in branch_lines}
+    for source, destination in data.get('arcs', []):
+        if source in destinations:
+            destinations[source].add(destination)
+
+    missing_lines = sorted(lines - executed)
+    missing_branches = sorted(line for line, taken in destinations.items() if len(taken) < 2)
+    branches = 2 * len(branch_lines)
+    covered_branches = sum(min(len(taken), 2) for taken in destinations.values())
+    return {
+        'lines': sorted(lines),
+        'missing_lines': missing_lines,
+        'branches': branches,
+        'missing_branches': missing_branches,
+        'line_rate': 1 - len(missing_lines) / len(lines) if lines else 1.0,
+        'branch_rate': covered_branches / branches if branches else 1.0,
+        'timed_out': run['timed_out'],
+    }
+
+
+def improve_coverage(file_path: Path, name: str, code: str, lineno: int, node_ids: List[str], rounds: int = 1, extra_args: Sequence[str] = (), limits: Optional[SandboxLimits] = None, on_slow: str = 'reject', history_path: Optional[Path] = None, **kwargs: Any) -> Dict[str, Any]:
+    """
+    Iteratively generate tests for the lines that are not covered yet.
+
+    Every round measures the coverage of the existing tests and sends only the
+    code annotated with its uncovered lines back to the model. The new tests
+    are added next to the existing ones instead of replacing them, and are
+    verified like the first generation, see `verify_tests`. With a
+    `history_path`, every follow-up is recorded as a run of the function or
+    class, together with the results of its tests.
+
+    Args:
+        file_path: Python file containing the function or class under test
+        name: Name of the function or class
+        code: Source code of the function or class
+        lineno: Line of `file_path` on which `code` starts
+        node_ids: pytest node IDs of the existing tests of the function or class
+        rounds: Maximum number of follow-up generations
+        extra_args: Additional command line arguments for pytest
+        limits: Resource limits for running the tests
+        on_slow: Policy for slow new tests, see `apply_test_budget`
+        history_path: SQLite database to record the runs in, see `record_run`
+        **kwargs: Additional arguments for `generate_tests`
+
+    Returns:
+        The coverage of the last measurement, see `measure_coverage`
+    """
+
+    end_lineno = lineno + len(code.splitlines()) - 1
+    node_ids = list(node_ids)
+    for round_ in range(rounds + 1):
+        result = measure_coverage(node_ids, file_path, lineno, end_lineno, extra_args, limits)
+        print(f"Coverage of {name}: {result['line_rate']:.0%} of lines, {result['branch_rate']:.0%} of branches")
+        missing = sorted(set(result['missing_lines']) | set(result['missing_branches']))
+        if not missing or round_ == rounds:
+            return result
+        report = {}
+        annotated_code = annotate_lines(code, lineno, missing)
+        success, _ = generate_tests(Path(file_path), annotated_code, name, report=report, instructions=FOLLOW_UP_INSTRUCTIONS, replace_existing=False, **kwargs)
+        # Recorded here rather than by `generate_tests`, which only knows the annotated code
+        if history_path is not None and report.get('validation') != 'cancelled':
+            report['run_id'] = record_run(name, code, report, kwargs.get('structured', False), history_path)
+        if not success or not report['node_ids']:
+            return result
+        node_ids += verify_tests(report['node_ids'], code, extra_args, limits, on_slow, report.get('run_id'), history_path)
+    return result
+
+
+def annotate_lines(code: str, lineno: int, lines: List[int], marker: str = "# NOT COVERED") -> str:
+    """Append a marker comment to the given lines of code that starts on line `lineno`."""
+
+    lines = set(lines)
+    return "\n".join(f"{line}  {marker}" if i in lines else line for i, line in enumerate(code.splitlines(), lineno))
+
+
+def _executable_lines(file_path: Path, lineno: int, end_lineno: int) -> Set[int]:
+    """Collect the lines within the span that have bytecode."""
+
+    code = compile(file_path.read_text(encoding='utf-8'), str(file_path), 'exec')
+    lines = set()
+    stack = [code]
+    while stack:
+        code = stack.pop()
+        lines.update(line for _, _, line in code.co_lines() if line is not None and lineno <= line <= end_lineno)
+        stack.extend(c for c in code.co_consts if hasattr(c, 'co_lines'))
+    return lines
+
+
+def _branch_lines(file_path: Path, lineno: int, end_lineno: int) -> Set[int]:
+    tree = ast.parse(file_path.read_text(encoding='utf-8'))
+    return {n.lineno for n in ast.walk(tree) if isinstance(n, BRANCH_NODES) and lineno <= n.lineno <= end_lineno}
+
+
+class _Collector:
+    """Record executed lines and line-to-line branch arcs of a single file."""
+
+    def __init__(self, file_path: str, lineno: int, end_lineno: int):
+        self.file_path = os.path.realpath(file_path)
+        self.lineno = lineno
+        self.end_lineno = end_lineno
+        self.lines: Set[int] = set()
+        self.arcs: Set[Tuple[int, int]] = set()
+        self._is_target: Dict[str, bool] = {}
+
+    def is_target(self, filename: str) -> bool:
+        if filename not in self._is_target:
+            self._is_target[filename] = os.path.realpath(filename) == self.file_path
+        return self._is_target[filename]
+
+    def in_span(self, line: Optional[int]) -> bool:
+        return line is not None and self.lineno <= line <= self.end_lineno
+
+    def start(self) -> None:
+        if sys.version_info >= (3, 12):
+            self._start_monitoring()
+        else:
+            self._start_settrace()
+
+    def _start_monitoring(self) -> None:
+        """Use the low-overhead `sys.monitoring` API, disabling events of other files."""
+
+        monitoring = sys.monitoring
+        tool = monitoring.COVERAGE_ID
+        monitoring.use_tool_id(tool, 'klaradvn')
+        offsets_to_lines: Dict[Any, Callable[[int], Optional[int]]] = {}
+
+        def line_of(code, offset):
+            if code not in offsets_to_lines:
+                ranges = list(code.co_lines())
+                offsets_to_lines[code] = lambda o: next((line for start, end, line in ranges if start <= o < end), None)
+            return offsets_to_lines[code](offset)
+
+        def on_line(code, line):
+            if self.is_target(code.co_filename) and self.in_span(line):
+                self.lines.add(line)
+            # Every line only has to be seen once
+            return monitoring.DISABLE
+
+        def on_branch(code, offset, destination):
+            if not self.is_target(code.co_filename):
+                return monitoring.DISABLE
+            source = line_of(code, offset)
+            if self.in_span(source):
+                self.arcs.add((source, line_of(code, destination)))
+
+        monitoring.register_callback(tool, monitoring.events.LINE, on_line)
+        monitoring.register_callback(tool, monitoring.events.BRANCH, on_branch)
+        monitoring.set_events(tool, monitoring.events.LINE | monitoring.events.BRANCH)
+
+    def _start_settrace(self) -> None:
+        """Fall back to `sys.settrace`, only tracing the frames of the target file."""
+
+        def trace_calls(frame, event, arg):
+            if event != 'call' or not self.is_target(frame.f_code.co_filename):
+                return None
+            previous = None
+
+            def trace_lines(frame, event, arg):
+                nonlocal previous
+                line = frame.f_lineno
+                if event == 'line':
+                    if self.in_span(line):
+                        self.lines.add(line)
+                    if self.in_span(previous):
+                        self.arcs.add((previous, line))
+                elif event == 'return' and self.in_span(previous):
+                    self.arcs.add((previous, -1))
+                previous = line
+                return trace_lines
+
+            return trace_lines
+
+        sys.settrace(trace_calls)
+        threading.settrace(trace_calls)
+
+    def save(self, output: str) -> None:
+        Path(output).write_text(json.dumps({'lines': sorted(self.lines), 'arcs': sorted(self.arcs)}), encoding='utf-8')
+
+
+def _main(argv: List[str]) -> int:
+    """Entry point of the pytest subprocess started by `measure_coverage`."""
+
+    import pytest
+
+    output, file_path, lineno, end_lineno, _, *pytest_args = argv
+    collector = _Collector(file_path, int(lineno), int(end_lineno))
+    collector.start()
+    exit_code = pytest.main(pytest_args)
+    collector.save(output)
+    return int(exit_code)
+
+
+if __name__ == '__main__':
+    sys.exit(_main(sys.argv[1:]))
@@ -0,0 +1,119 @@
+import ast
+import copy
+import hashlib
+from typing import Dict, List, Optional, Set
+
+SCOPE_NODES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)
+
+
+def normalized_hash(node: ast.stmt) -> str:
+    """
+    Hash a test function or class so that near-identical tests get the same hash.
+
+    The test is normalized before hashing:
+    - test, method and class names and docstrings are dropped
+    - local variables are renamed in order of appearance. Parameters of tests
+      are kept, as in pytest they name the fixtures the test uses
+    - numbers are reduced to their sign and strings and bytes to being empty or
+      not, numbered by distinct value. `f(3, 3)` and `f(1, 2)` stay different,
+      `f(1, 2)` and `f(5, 10)` do not. Booleans and None are kept as they are
+
+    Args:
+        node: Test function or test class
+
+    Returns:
+        SHA-256 hash of the normalized AST
+    """
+
+    node = _Normalizer().visit(copy.deepcopy(node))
+    return hashlib.sha256(ast.dump(node, annotate_fields=False).encode('utf-8')).hexdigest()
+
+
+def deduplicate(tests: List[ast.stmt], seen: Optional[Set[str]] = None) -> List[ast.stmt]:
+    """
+    Drop tests that are semantically identical to an earlier test.
+
+    Args:
+        tests: Test functions or classes in order of preference
+        seen: Hashes of tests that are already kept elsewhere, updated in place
+
+    Returns:
+        The tests without duplicates
+    """
+
+    seen = set() if seen is None else seen
+    unique = []
+    for test in tests:
+        digest = normalized_hash(test)
+        if digest not in seen:
+            seen.add(digest)
+            unique.append(test)
+    return unique
+
+
+class _Normalizer(ast.NodeTransformer):
+    def __init__(self):
+        self.locals: Set[str] = set()
+        self.names: Dict[str, str] = {}
+        self.literals: Dict[object, str] = {}
+
+    def _rename(self, name: str) -> str:
+        if name not in self.names:
+            self.names[name] = f"v{len(self.names)}"
+        return self.names[name]
+
+    def _strip(self, node):
+        node.name = ''
+        if node.body and isinstance(node.body[0], ast.Expr) and isinstance(node.body[0].value, ast.Constant) \
+                and isinstance(node.body[0].value.value, str) and len(node.body) > 1:
+            node.body = node.body[1:]
+
+    def visit_ClassDef(self, node):
+        self._strip(node)
+        return self.generic_visit(node)
+
+    def visit_FunctionDef(self, node):
+        self._strip(node)
+        # Every name that is assigned in the function is local, as are the
+        # parameters of nested functions and lambdas
+        parameters = {a.arg for a in ast.walk(node.args) if isinstance(a, ast.arg)}
+        self.locals |= {n.id for n in ast.walk(node) if isinstance(n, ast.Name) and isinstance(n.ctx, (ast.Store, ast.Del))}
+        self.locals |= {n.name for n in ast.walk(node) if isinstance(n, ast.ExceptHandler) and n.name}
+        self.locals |= {a.arg for n in ast.walk(node) if isinstance(n, SCOPE_NODES) and n is not node
+                        for a in ast.walk(n.args) if isinstance(a, ast.arg)}
+        self.locals -= parameters
+        return self.generic_visit(node)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_arg(self, node):
+        if node.arg in self.locals:
+            node.arg = self._rename(node.arg)
+        node.annotation = None
+        return node
+
+    def visit_Name(self, node):
+        if node.id in self.locals:
+            node.id = self._rename(node.id)
+        return node
+
+    def visit_ExceptHandler(self, node):
+        if node.name in self.locals:
+            node.name = self._rename(node.name)
+        return self.generic_visit(node)
+
+    def visit_Constant(self, node):
+        value = node.value
+        if value is None or isinstance(value, bool) or value is ...:
+            return node
+        if isinstance(value, (int, float, complex)):
+            kind = 'zero' if value == 0 else ('negative' if getattr(value, 'real', value) < 0 else 'positive')
+        elif isinstance(value, (str, bytes)):
+            kind = f"{type(value).__name__}:{'empty' if not value else 'value'}"
+        else:
+            kind = type(value).__name__
+        key = (type(value), value)
+        if key not in self.literals:
+            self.literals[key] = f"{kind}#{len(self.literals)}"
+        node.value = self.literals[key]
+        return node
@@ -1,88 +1,52 @@
 import os
 import ast
+import json
 import inspect
+import hashlib
+import textwrap
 from pathlib import Path
 import importlib.util
+from collections import defaultdict
 from dataclasses import is_dataclass, fields
-from typing import Dict, List, Tuple, Any, Optional
+from typing import Dict, Iterator, List, Tuple, Any, Optional
 
 
-def extract_function_code(folder_path: str, function_name: str) -> Optional[tuple[str, Path]]:
+SKIPPED_DIRS = {'__pycache__', 'venv', 'node_modules', 'build', 'dist'}
+# Project configuration rather than code to test
+SKIPPED_FILES = {'conftest.py', 'setup.py', 'noxfile.py'}
+SYMBOLS_FILE = 'symbols.json'
+
+
+def extract_function_code(folder_path: str, function_name: str, cache_dir: Optional[Path] = None) -> Optional[tuple[str, Path]]:
     """
     Find and return the code of a specified Python function within a folder.
+
+    The function is looked up in a `SymbolIndex` of the folder, so it can be a
+    method or a nested or async function. Either pass a qualified name like
+    `pkg.mod:Class.method`, a name within a module like `Class.method` or a bare
+    name like `method`, see `SymbolIndex.resolve`. Functions in test files are
+    not found.
     
     Args:
-        function_name: The name of the function to search for
+        function_name: The (qualified) name of the function to search for
         folder_path: Path to the folder containing Python files to search
+        cache_dir: Directory to store the symbol tables in, see `SymbolIndex`
         
     Returns:
-        The complete function code as a string if found, None otherwise
+        Tuple of the complete function code and the path of its file if found,
+        (None, None) otherwise
+
+    Raises:
+        AmbiguousSymbolError: If the name matches more than one function
     """
     # Check if folder exists
     if not os.path.isdir(folder_path):
         raise ValueError(f"Folder '{folder_path}' does not exist")
-    
-    # Function to extract the function code from an AST node
-    def get_function_code(node, source_code):
-        if isinstance(node, ast.FunctionDef) and node.name == function_name:
-            # Get line numbers (subtract 1 as line numbers are 1-indexed)
-            start_line = node.lineno - 1
-            end_line = node.end_lineno if hasattr(node, 'end_lineno') else start_line
-            
-            # For older Python versions that don't have end_lineno
-            if not hasattr(node, 'end_lineno'):
-                lines = source_code.splitlines()
-                indent = len(lines[start_line]) - len(lines[start_line].lstrip())
-                
-                # Find the end of the function by tracking indentation
-                end_line = start_line
-                for i in range(start_line + 1, len(lines)):
-                    if i >= len(lines) or (lines[i].strip() and len(lines[i]) - len(lines[i].lstrip()) <= indent):
-                        end_line = i - 1
-                        break
-                    end_line = i
-            
-            # Extract the function code
-            lines = source_code.splitlines()[start_line:end_line+1]
-            return '\n'.join(lines).rstrip()
-        return None
-    
-    # Recursively walk the AST to find the function
-    def find_function_in_ast(node, source_code):
-        # Try to extract the function from the current node
-        result = get_function_code(node, source_code)
-        if result:
-            return result
-        
-        # Recursively search in child nodes
-        for child in ast.iter_child_nodes(node):
-            result = find_function_in_ast(child, source_code)
-            if result:
-                return result
-        return None
-    
-    # Search through all Python files in the folder
-    for root, _, files in os.walk(folder_path):
-        for file in files:
-            if file.endswith('.py'):
-                file_path = os.path.join(root, file)
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        source_code = f.read()
-                    
-                    # Parse the file into an AST
-                    try:
-                        tree = ast.parse(source_code)
-                        result = find_function_in_ast(tree, source_code)
-                        if result:
-                            return result, Path(file_path)
-                    except SyntaxError:
-                        # Skip files with syntax errors
-                        continue
-                except Exception as e:
-                    print(f"Error processing {file_path}: {str(e)}")
-    
-    return None, None
+
+    symbol = SymbolIndex(Path(folder_path), cache_dir).resolve(function_name, kind='function')
+    if symbol is None:
+        return None, None
+    return symbol['source_code'], symbol['file_path']
 
 
 def extract_class(folder: Path, class_name: str) -> Optional[Tuple[Any, Dict[str, Any]]]:
@@ -90,8 +54,8 @@ def extract_class(folder: Path, class_name: str) -> Optional[Tuple[Any, Dict[str
     Find a Python class in a folder and return the class object with all its methods, dataclass info, and complete source code.
     
     Args:
-        folder_path (str | Path): Path to the folder to search in
-        class_name (str): Name of the class to find
+        folder_path (str | Path): Path to the folder to search in, or to the Python file that defines the class
+        class_name (str): Name of the class to find, `Outer.Inner` for a nested class
     
     Returns:
         Tuple containing:
@@ -110,34 +74,59 @@ def extract_class(folder: Path, class_name: str) -> Optional[Tuple[Any, Dict[str
     """
     
     # Recursively find all Python files
-    for file_path in folder.rglob('*.py'):
+    for file_path in [folder] if folder.is_file() else folder.rglob('*.py'):
         # Skip __init__.py and other dunder files
-        if file_path.name.startswith('__'):
+        if file_path.name.startswith('__') and file_path != folder:
             continue
-            
+        # Only execute the modules that define the class, executing every module
+        # of a large repository is slow and keeps all of them in memory
+        if not _defines_class(file_path, class_name):
+            continue
+
         try:
             # Load the module dynamically
             spec = importlib.util.spec_from_file_location("temp_module", file_path)
             if spec and spec.loader:
                 module = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(module)
-                
-                # Check if the class exists in this module
-                if hasattr(module, class_name):
-                    cls_ = getattr(module, class_name)
-                    
+                try:
+                    spec.loader.exec_module(module)
+
+                    # Check if the class exists in this module
+                    cls_ = module
+                    for part in class_name.split('.'):
+                        cls_ = getattr(cls_, part, None)
+
                     # Verify it's actually a class
                     if inspect.isclass(cls_):
-                        class_info = _extract_class_info(cls_, file_path)
-                        return class_info
-                        
+                        return _extract_class_info(cls_, file_path)
+                finally:
+                    # Break the reference cycles between the module and its functions,
+                    # so the module is freed right away instead of by the garbage collector
+                    module.__dict__.clear()
+
         except Exception as e:
             # Skip files that can't be imported
             print(f"Warning: Could not import {file_path}: {e}")
             continue
-    
+
     return None
 
+def _defines_class(file_path: Path, class_name: str) -> bool:
+    """Check without executing the file whether it contains the definition of a class."""
+
+    class_name = class_name.rsplit('.', 1)[-1]
+    try:
+        source_code = file_path.read_text(encoding='utf-8')
+    except (OSError, UnicodeDecodeError):
+        return False
+    if f"class {class_name}" not in source_code:
+        return False
+    try:
+        tree = ast.parse(source_code)
+    except SyntaxError:
+        return False
+    return any(isinstance(node, ast.ClassDef) and node.name == class_name for node in ast.walk(tree))
+
 def _extract_class_info(cls: type, file_path: Path) -> Dict[str, Any]:
     """Extract and categorize all methods and information from a class, including complete source code with decorators."""
     
@@ -371,4 +360,232 @@ def _extract_dataclass_methods(cls: type) -> List[str]:
             if hasattr(method, '__qualname__') and cls.__name__ in method.__qualname__:
                 dataclass_methods.append(method_name)
     
-    return dataclass_methods
\ No newline at end of file
+    return dataclass_methods
+
+def extract_symbols(file_path: Path, nested: bool = False) -> Dict[str, Dict[str, Any]]:
+    """
+    Extract all top-level functions and classes of a Python file.
+    
+    Args:
+        file_path: Path to the Python file
+        nested: Also extract methods, nested functions and classes and the
+            functions and classes defined in `if`, `try` or `with` blocks, keyed
+            by their name within the module like `Class.method` or `outer.inner`
+        
+    Returns:
+        Dictionary mapping the symbol names to a dictionary with:
+        - 'kind': Either 'function' or 'class'
+        - 'is_async': Whether the function is defined with `async def`
+        - 'source_code': Source code of the symbol including its decorators,
+          dedented for nested symbols
+        - 'lineno' and 'end_lineno': First and last line of the symbol (1-indexed)
+        - 'hash': SHA-256 hash of the source code
+        When a name is defined twice, the last definition is kept, as it is the
+        one bound at runtime. Returns an empty dictionary if the file has
+        syntax errors.
+    """
+
+    source_code = Path(file_path).read_text(encoding='utf-8')
+    try:
+        tree = ast.parse(source_code)
+    except SyntaxError:
+        return {}
+
+    lines = source_code.splitlines()
+    symbols = {}
+
+    def add_symbols(body: List[ast.stmt], prefix: str) -> None:
+        for node in body:
+            if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                if nested:
+                    # Definitions in compound statements are bound in the enclosing scope
+                    for field in ('body', 'orelse', 'finalbody'):
+                        add_symbols(getattr(node, field, []), prefix)
+                    for handler in getattr(node, 'handlers', []):
+                        add_symbols(handler.body, prefix)
+                continue
+            start_line = min([node.lineno] + [d.lineno for d in node.decorator_list])
+            code = '\n'.join(lines[start_line - 1:node.end_lineno]).rstrip()
+            if node.col_offset:
+                code = textwrap.dedent(code)
+            symbols[prefix + node.name] = {
+                'kind': 'class' if isinstance(node, ast.ClassDef) else 'function',
+                'is_async': isinstance(node, ast.AsyncFunctionDef),
+                'source_code': code,
+                'lineno': start_line,
+                'end_lineno': node.end_lineno,
+                'hash': hashlib.sha256(code.encode('utf-8')).hexdigest(),
+            }
+            if nested:
+                add_symbols(node.body, f"{prefix}{node.name}.")
+
+    add_symbols(tree.body, '')
+    return symbols
+
+
+class AmbiguousSymbolError(ValueError):
+    """Raised when a name matches more than one function or class."""
+
+    def __init__(self, name: str, candidates: List[str]):
+        super().__init__(f"'{name}' is ambiguous, use one of the qualified names: {', '.join(candidates)}")
+        self.name = name
+        self.candidates = candidates
+
+
+class SymbolIndex:
+    """
+    Symbol tables of all source files in a folder, for lookups by qualified name.
+
+    Every function and class, including methods and nested and async functions,
+    is indexed by its qualified name `module:name`, where `module` is the dotted
+    module path relative to the folder (`pkg.mod`) and `name` is the name within
+    the module (`Class.method`). Test files and skipped directories are not
+    indexed. The symbol tables hold the line range of every symbol, the source
+    code is read from the file when the symbol is resolved. They are kept in
+    memory, keyed by the modification time and size of their file, so building
+    the index again only parses the files that changed. With a `cache_dir`,
+    usually `.klaradvn` in the project, they are also stored in `symbols.json`
+    there for later processes.
+    """
+
+    def __init__(self, folder: Path, cache_dir: Optional[Path] = None):
+        self.folder = Path(folder)
+        self.symbols: Dict[str, Dict[str, Any]] = {}
+        self._by_name: Dict[str, List[str]] = defaultdict(list)
+        self._by_last_name: Dict[str, List[str]] = defaultdict(list)
+        cache_path = Path(cache_dir) / SYMBOLS_FILE if cache_dir is not None else None
+        stored = _load_symbol_tables(cache_path) if cache_path else {}
+        tables = {}
+        for file_path in sorted(source_files(self.folder)):
+            relative_path = file_path.relative_to(self.folder).as_posix()
+            tables[relative_path] = _symbol_table(file_path, stored.get(relative_path))
+        if cache_path and tables != stored:
+            _save_symbol_tables(cache_path, tables)
+        for relative_path, (_, table) in tables.items():
+            file_path = self.folder / relative_path
+            module = _module_name(file_path, self.folder)
+            for name, symbol in table.items():
+                qualified_name = f"{module}:{name}"
+                self.symbols[qualified_name] = dict(symbol, name=name, module=module, qualified_name=qualified_name, file_path=file_path)
+                self._by_name[name].append(qualified_name)
+                self._by_last_name[name.rsplit('.', 1)[-1]].append(qualified_name)
+
+    def resolve(self, name: str, kind: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Look up a function or class by name.
+
+        Args:
+            name: Qualified name (`pkg.mod:Class.method`), name within a module
+                (`Class.method`) or bare name (`method`). A bare name matches the
+                top-level symbols of that name and only when there are none the
+                methods and nested symbols of that name.
+            kind: Only match symbols of this kind, 'function' or 'class'
+
+        Returns:
+            The symbol as returned by `extract_symbols`, with its 'name' within
+            the module, 'module', 'qualified_name' and 'file_path', or None if
+            no symbol matches
+
+        Raises:
+            AmbiguousSymbolError: If more than one symbol matches
+        """
+
+        def matching(names: List[str]) -> List[str]:
+            return [n for n in names if kind is None or self.symbols[n]['kind'] == kind]
+
+        if ':' in name:
+            candidates = matching([name] if name in self.symbols else [])
+        else:
+            candidates = matching(self._by_name.get(name, [])) or matching(self._by_last_name.get(name, []))
+        if len(candidates) > 1:
+            raise AmbiguousSymbolError(name, candidates)
+        if not candidates:
+            return None
+        symbol = self.symbols[candidates[0]]
+        return dict(symbol, source_code=_symbol_source(symbol['file_path'], symbol['lineno'], symbol['end_lineno']))
+
+
+def _symbol_source(file_path: Path, lineno: int, end_lineno: int) -> str:
+    """Read the source code of a symbol from its file, like `extract_symbols` does."""
+
+    lines = file_path.read_text(encoding='utf-8').splitlines()
+    code = '\n'.join(lines[lineno - 1:end_lineno]).rstrip()
+    return textwrap.dedent(code) if code[:1].isspace() else code
+
+
+# Symbol tables per file, without the source code, with the modification time and size they were built for
+_symbol_tables: Dict[Path, Tuple[Tuple[int, int], Dict[str, Dict[str, Any]]]] = {}
+
+
+def _symbol_table(file_path: Path, stored: Optional[Tuple[Tuple[int, int], Dict[str, Dict[str, Any]]]] = None) -> Tuple[Tuple[int, int], Dict[str, Dict[str, Any]]]:
+    """Return the (modification time and size, symbol table) of a file, reusing the in-memory or the stored table while the file is unchanged."""
+
+    try:
+        stat = file_path.stat()
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = _symbol_tables.get(file_path)
+        if cached and cached[0] == key:
+            return cached
+        if stored and stored[0] == key:
+            table = stored[1]
+        else:
+            table = {name: {k: v for k, v in symbol.items() if k != 'source_code'} for name, symbol in extract_symbols(file_path, nested=True).items()}
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"Error processing {file_path}: {str(e)}")
+        return (0, 0), {}
+    _symbol_tables[file_path] = (key, table)
+    return key, table
+
+
+def _load_symbol_tables(cache_path: Path) -> Dict[str, Tuple[Tuple[int, int], Dict[str, Dict[str, Any]]]]:
+    try:
+        data = json.loads(cache_path.read_text(encoding='utf-8'))
+        return {path: (tuple(entry['stat']), entry['symbols']) for path, entry in data.items()}
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return {}
+
+
+def _save_symbol_tables(cache_path: Path, tables: Dict[str, Tuple[Tuple[int, int], Dict[str, Dict[str, Any]]]]) -> None:
+    data = {path: {'stat': list(key), 'symbols': table} for path, (key, table) in tables.items()}
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(json.dumps(data), encoding='utf-8')
+    except OSError as e:
+        # The index still works without the stored tables, it is only slower to build next time
+        print(f"Could not store the symbol tables in {cache_path}: {e}")
+
+
+def _module_name(file_path: Path, folder: Path) -> str:
+    parts = list(file_path.relative_to(folder).with_suffix('').parts)
+    if parts[-1] == '__init__' and len(parts) > 1:
+        parts.pop()
+    return '.'.join(parts)
+
+
+def is_source_file(file_path: Path, root: Path) -> bool:
+    """Check whether a file is code to generate tests for, rather than a test or project configuration."""
+
+    parts = file_path.relative_to(root).parts
+    return (file_path.suffix == '.py'
+            and file_path.name not in SKIPPED_FILES
+            and not file_path.name.startswith('test_')
+            and not file_path.name.endswith('_test.py')
+            and 'tests' not in parts[:-1]
+            and not any(p.startswith('.') or p in SKIPPED_DIRS for p in parts[:-1]))
+
+
+def source_files(root: Path) -> Iterator[Path]:
+    """Yield the files below `root` that are code to generate tests for, see `is_source_file`."""
+
+    for dir_path in directories(root):
+        for file_path in dir_path.glob('*.py'):
+            if is_source_file(file_path, root):
+                yield file_path
+
+
+def directories(root: Path) -> Iterator[Path]:
+    """Yield `root` and its subdirectories, except hidden and skipped ones."""
+
+    for dir_path, dir_names, _ in os.walk(root):
+        dir_names[:] = [d for d in dir_names if not d.startswith('.') and d not in SKIPPED_DIRS]
+        yield Path(dir_path)
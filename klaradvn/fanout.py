@@ -0,0 +1,235 @@
+import re
+import ast
+import time
+import textwrap
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from klaradvn.budget import generation_options
+from klaradvn.client import ClientConfig
+from klaradvn.dedup import deduplicate
+from klaradvn.generate import prompt_hash, generate_test_code, test_file_path, write_tests
+from klaradvn.history import record_run
+from klaradvn.writer import is_test, statement_name, unique_name, rename_symbols
+
+# Methods pytest calls around the tests of a class
+SETUP_METHODS = {'setup_class', 'teardown_class', 'setup_method', 'teardown_method', 'setup', 'teardown', 'setUp', 'tearDown'}
+
+METHOD_INSTRUCTIONS = """
+Only write tests for the method `{method}` of the class `{class_name}`; the other methods are only shown as signatures.
+"""
+
+
+def class_skeleton(source_code: str, keep: Optional[str] = None) -> str:
+    """
+    Build a compact skeleton of a class.
+
+    Decorators, class attributes and `__init__` are kept, the bodies of the
+    other methods are replaced by their docstring and `...`.
+
+    Args:
+        source_code: Source code of the class
+        keep: Name of a method whose complete body is kept as well
+
+    Returns:
+        Source code of the class skeleton
+    """
+
+    tree = ast.parse(textwrap.dedent(source_code))
+    cls = next(n for n in tree.body if isinstance(n, ast.ClassDef))
+    for node in cls.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name not in ('__init__', keep):
+            docstring = ast.get_docstring(node)
+            node.body = ([ast.Expr(ast.Constant(docstring))] if docstring else []) + [ast.Expr(ast.Constant(...))]
+    return ast.unparse(cls)
+
+
+def _method_source(source_code: str, method: str) -> Optional[str]:
+    """Return the source of a method of a class, None if the class has no such method."""
+
+    source_code = textwrap.dedent(source_code)
+    cls = next(n for n in ast.parse(source_code).body if isinstance(n, ast.ClassDef))
+    for node in cls.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == method:
+            return ast.get_source_segment(source_code, node)
+    return None
+
+
+def generate_class_tests(code_file: Path, class_info: Dict[str, Any], class_name: str, max_workers: int = 4, structured: bool = False, report: Optional[Dict[str, Any]] = None, client_config: Optional[ClientConfig] = None, instructions: Optional[str] = None, history_path: Optional[Path] = None) -> Tuple[bool, Path]:
+    """
+    Generate the tests of a class per method concurrently and merge them into one test class.
+
+    Every prompt only holds the class skeleton with the complete source of a
+    single method, so prompts stay small regardless of the size of the class.
+    The token budget of every generation is measured on that method alone.
+
+    Args:
+        code_file: Path to the Python file containing the class
+        class_info: Class information as returned by `extract_class`
+        class_name: Name of the class
+        max_workers: Maximum number of concurrent generations
+        structured: Constrain the model output to a JSON schema, see `generate_tests`
+        report: Optional dictionary that is filled with the summed token counts,
+            the total latency, the metrics per method, the written tests and,
+            with `history_path`, the 'run_id' of the run in the history
+        client_config: Timeouts and retry settings for the ollama requests
+        instructions: Additional instructions appended to every prompt
+        history_path: SQLite database to record the run in, see `generate_tests`
+
+    Returns:
+        Tuple of (success, output_file_path)
+    """
+
+    methods = (class_info['instance_methods'] + class_info['class_methods']
+               + class_info['static_methods'] + class_info['properties'])
+    print("\n" + "="* 30 + f" Klara is creating the unittests for {class_name} " + "="*30)
+    print(f"Generating tests for {len(methods)} methods of {class_name} in {code_file} using {max_workers} workers...")
+
+    def generate(method: str) -> Tuple[str, Optional[str], Dict[str, Any]]:
+        method_report = {}
+        code = class_skeleton(class_info['source_code'], keep=method)
+        options = generation_options(_method_source(class_info['source_code'], method) or code, structured)
+        method_instructions = METHOD_INSTRUCTIONS.format(method=method, class_name=class_name) + (instructions or "")
+        test_code = generate_test_code(code, f"{class_name}.{method}", structured, method_report, client_config, instructions=method_instructions, echo=False, options=options)
+        print(f"{'Generated' if test_code is not None else 'Failed to generate'} tests for {class_name}.{method}")
+        return method, test_code, method_report
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers) as pool:
+        results = list(pool.map(generate, methods))
+    total_latency = time.perf_counter() - start
+
+    report = {} if report is None else report
+    report['prompt_tokens'] = sum(r.get('prompt_tokens') or 0 for _, _, r in results)
+    report['output_tokens'] = sum(r.get('output_tokens') or 0 for _, _, r in results)
+    report['total_latency'] = total_latency
+    report['methods'] = {method: r for method, _, r in results}
+    first_tokens = [r['time_to_first_token'] for _, _, r in results if r.get('time_to_first_token') is not None]
+    report['time_to_first_token'] = min(first_tokens, default=None)
+    report['prompt_hash'] = prompt_hash(structured)
+
+    success, output_file = False, test_file_path(code_file)
+    test_codes = [code for _, code, _ in results if code is not None]
+    if not test_codes:
+        report['validation'] = 'no response'
+    else:
+        try:
+            test_code = merge_into_test_class(test_codes, f"Test{class_name}")
+        except SyntaxError as e:
+            print(f"\nGenerated tests are not valid Python: {e}")
+            report['validation'] = 'invalid'
+        else:
+            print(f"Generated the tests of {class_name} in {total_latency:.2f}s")
+            success, output_file = write_tests(code_file, test_code, class_name, report=report)
+    if history_path is not None:
+        report['run_id'] = record_run(class_name, class_info['source_code'], report, structured, history_path)
+    return success, output_file
+
+
+def _keeps_class(node: ast.stmt) -> bool:
+    # Flattening a test class into another one loses its state and its xunit-style setup and teardown
+    if not isinstance(node, ast.ClassDef):
+        return False
+    if node.bases or node.keywords or node.decorator_list:
+        return True
+    for statement in node.body:
+        if isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            if statement.name in SETUP_METHODS:
+                return True
+        elif not (isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Constant)):
+            return True
+    return False
+
+
+def merge_into_test_class(test_codes: List[str], test_class_name: str) -> str:
+    """
+    Merge several pieces of generated test code into a single test class.
+
+    Test functions become methods of the class and the methods of generated
+    test classes are moved into it, dropping near-identical tests. Test classes
+    with class attributes, decorators, base classes or setup and teardown methods
+    stay separate, since their methods depend on them. Imports and other
+    statements such as fixtures stay at module level, without duplicates. A
+    fixture, helper or test class that clashes with a different one of the same
+    name is renamed, together with its uses in its own piece of test code.
+
+    Args:
+        test_codes: Generated test code, one piece per method
+        test_class_name: Name of the resulting test class
+
+    Returns:
+        The merged test code
+
+    Raises:
+        SyntaxError: If none of the pieces of test code parse
+    """
+
+    imports = []
+    others = []
+    methods = []
+    names = set()
+    seen = set()
+    definitions = {}
+    error = None
+    for test_code in test_codes:
+        try:
+            tree = ast.parse(test_code)
+        except SyntaxError as e:
+            # Skip the tests of a single method rather than all of them
+            error = e
+            continue
+        renames = {}
+        taken = set(definitions) | set(re.findall(r'\w+', test_code))
+        for node in tree.body:
+            name = statement_name(node)
+            if name in definitions and (not is_test(node) or _keeps_class(node)) and definitions[name] != ast.dump(node):
+                renames[name] = unique_name(name, taken)
+                taken.add(renames[name])
+        if renames:
+            test_code = rename_symbols(test_code, renames)
+            tree = ast.parse(test_code)
+        lines = test_code.splitlines()
+        for node in tree.body:
+            start = min([node.lineno] + [d.lineno for d in getattr(node, 'decorator_list', [])])
+            segment = textwrap.dedent("\n".join(lines[start - 1:node.end_lineno]))
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name.startswith('test'):
+                if deduplicate([node], seen):
+                    methods.append(_unique_method(_add_self(segment), node.name, names))
+            elif isinstance(node, ast.ClassDef) and node.name.startswith('Test') and not _keeps_class(node):
+                for method in node.body:
+                    if isinstance(method, (ast.FunctionDef, ast.AsyncFunctionDef)) and deduplicate([method], seen):
+                        start = min([method.lineno] + [d.lineno for d in method.decorator_list])
+                        method_segment = textwrap.dedent("\n".join(lines[start - 1:method.end_lineno]))
+                        methods.append(_unique_method(method_segment, method.name, names))
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                if segment not in imports:
+                    imports.append(segment)
+            elif (name := statement_name(node)) is not None:
+                if name not in definitions:
+                    definitions[name] = ast.dump(node)
+                    others.append(segment)
+            elif segment not in others:
+                others.append(segment)
+    if not methods and error is not None:
+        raise error
+
+    body = "\n\n".join(textwrap.indent(m, '    ') for m in methods) or "    pass"
+    return "\n\n\n".join(["\n".join(imports)] + others + [f"class {test_class_name}:\n{body}"]) + "\n"
+
+
+def _add_self(source: str) -> str:
+    """Turn a test function into a method by adding `self` as first parameter."""
+
+    source = re.sub(r'(def\s+\w+\s*\()', r'\1self, ', source, count=1)
+    return re.sub(r'(def\s+\w+\s*\(self), (\s*\))', r'\1\2', source, count=1)
+
+
+def _unique_method(source: str, name: str, names: set) -> str:
+    """Rename a test method that would shadow a method generated for another method."""
+
+    candidate, i = name, 2
+    while candidate in names:
+        candidate, i = f"{name}_{i}", i + 1
+    names.add(candidate)
+    return source if candidate == name else re.sub(rf'def\s+{name}\b', f"def {candidate}", source, count=1)
@@ -1,25 +1,220 @@
 import os
 import re
-from typing import Tuple
+import json
+import hashlib
+import time
+import textwrap
+import threading
+from typing import Any, Dict, Optional, Tuple
 from pathlib import Path
 import datetime
 
 
+import httpx
 import ollama
 
-def generate_tests(code_file: Path, code: str, function_name: str) -> Tuple[bool, Path]:
+from klaradvn.budget import generation_options
+from klaradvn.client import ClientConfig, GenerationCancelled, stream_generate
+from klaradvn.history import record_run
+from klaradvn.writer import merge_tests
+
+# JSON schema used for the structured-output generation mode. Every test
+# comes back as its own object so it can be assembled without any parsing.
+STRUCTURED_TESTS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "tests": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "body": {"type": "string"},
+                    "imports": {"type": "array", "items": {"type": "string"}},
+                },
+                "required": ["name", "body", "imports"],
+            },
+        },
+    },
+    "required": ["tests"],
+}
+
+
+def generate_tests(code_file: Path, code: str, function_name: str, structured: bool = False, report: Optional[Dict[str, Any]] = None, client_config: Optional[ClientConfig] = None, cancel_event: Optional[threading.Event] = None, instructions: Optional[str] = None, replace_existing: bool = True, history_path: Optional[Path] = None) -> Tuple[bool, Path]:
     """
     Generate unit tests for a Python file using the custom Ollama model.
     
     Args:
         code_file: Path to the Python file to generate tests for
-        output_file: Path to save the generated tests (default: test_{original_filename})
+        code: Source code of the function or class to test
+        function_name: Name of the function or class to test
+        structured: Constrain the model output to `STRUCTURED_TESTS_SCHEMA` and
+            assemble the tests directly instead of parsing a free-form response
+        report: Optional dictionary that is filled with the generation metrics
+            (token counts, time to first token and total latency), the
+            'validation' result, the names and pytest node IDs of the written
+            tests and, with `history_path`, the 'run_id' of the run in the history
+        client_config: Timeouts and retry settings for the ollama requests
+        cancel_event: Event that aborts the generation when set
+        instructions: Additional instructions appended to the prompt
+        replace_existing: Replace the generated tests of `function_name` in the
+            test module, otherwise the new tests are added to them
+        history_path: SQLite database to record the run in, see `record_run`,
+            the run is not recorded without it
         
     Returns:
         Tuple of (success, output_file_path)
     """
 
+    output_file = test_file_path(code_file)
+
+    # Generate tests using Ollama
+    print("\n" + "="* 30 + f" Klara is creating the unittest for {function_name} " + "="*30)
+    print(f"Generating tests for {function_name} in {code_file}...")
+    print("This may take a moment depending on the size of your code...\n")
+    report = {} if report is None else report
+    test_code = generate_test_code(code, function_name, structured, report, client_config, cancel_event, instructions)
+    if test_code is None:
+        success = False
+    else:
+        success, output_file = write_tests(code_file, test_code, function_name, replace_existing, report)
+    if history_path is not None and report.get('validation') != 'cancelled':
+        report['run_id'] = record_run(function_name, code, report, structured, history_path)
+    return success, output_file
+
+
+def generate_test_code(code: str, function_name: str, structured: bool = False, report: Optional[Dict[str, Any]] = None, client_config: Optional[ClientConfig] = None, cancel_event: Optional[threading.Event] = None, instructions: Optional[str] = None, echo: bool = True, options: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """
+    Generate test code with the custom Ollama model without writing it to a file.
+
+    Args:
+        code: Source code of the function or class to test
+        function_name: Name of the function or class to test
+        structured: Constrain the model output to `STRUCTURED_TESTS_SCHEMA`
+        report: Optional dictionary that is filled with the generation metrics
+        client_config: Timeouts and retry settings for the ollama requests
+        cancel_event: Event that aborts the generation when set
+        instructions: Additional instructions appended to the prompt
+        echo: Print the response of the model while it is generated
+        options: Generation options of the model, defaults to the token budget
+            of `code`, see `generation_options`
+
+    Returns:
+        The generated test code, None if the generation failed
+    """
+
     # Create the prompt
+    prompt = build_prompt(code, structured, instructions)
+
+    if echo:
+        print("="*30 + " Klara's response " + "="*30)
+    response = ""
+    output_format = STRUCTURED_TESTS_SCHEMA if structured else None
+    options = options or generation_options(code, structured)
+    metrics = {'num_predict': options['num_predict'], 'time_to_first_token': None, 'prompt_hash': prompt_hash(structured)}
+    start = time.perf_counter()
+    try:
+        for chunk in stream_generate(prompt, client_config, cancel_event, format=output_format, options=options):
+            if chunk['response'] and metrics['time_to_first_token'] is None:
+                metrics['time_to_first_token'] = time.perf_counter() - start
+            response += chunk['response']
+            if echo:
+                print(chunk['response'], end='', flush=True)
+            if chunk['done']:
+                metrics['prompt_tokens'] = chunk.get('prompt_eval_count')
+                metrics['output_tokens'] = chunk.get('eval_count')
+                metrics['done_reason'] = chunk.get('done_reason')
+    except GenerationCancelled:
+        print(f"\nGeneration for {function_name} was cancelled")
+        if report is not None:
+            report['validation'] = 'cancelled'
+        return None
+    except KeyboardInterrupt:
+        print(f"\nGeneration for {function_name} was aborted")
+        raise
+    except (TimeoutError, ConnectionError, ollama.ResponseError, httpx.TransportError) as e:
+        print(f"\nError generating tests for {function_name}: {e}")
+        if report is not None:
+            report['validation'] = 'no response'
+        return None
+    metrics['total_latency'] = time.perf_counter() - start
+    if echo:
+        _print_metrics(metrics)
+    if report is not None:
+        report.update(metrics)
+
+    # Extract the test code
+    if structured:
+        try:
+            return assemble_structured_tests(response)
+        except ValueError as e:
+            print(f"\nError assembling structured response for {function_name}: {e}")
+            if report is not None:
+                report['validation'] = 'invalid'
+            return None
+    return extract_test_code(response)
+
+
+def write_tests(code_file: Path, test_code: str, function_name: str, replace_existing: bool = True, report: Optional[Dict[str, Any]] = None) -> Tuple[bool, Path]:
+    """
+    Write generated test code into the test module of a Python file.
+
+    Args:
+        code_file: Path to the Python file the tests were generated for
+        test_code: Generated test code
+        function_name: Name of the function or class the tests were generated for
+        replace_existing: Replace the generated tests of `function_name` in the
+            test module, otherwise the new tests are added to them
+        history_path: SQLite database to record the run in, see `record_run`,
+            the run is not recorded without it
+        report: Optional dictionary that is filled with the names and pytest
+            node IDs of the written tests
+
+    Returns:
+        Tuple of (success, output_file_path), success is False if the
+        generated code is not valid Python or contains no tests
+    """
+
+    output_file = test_file_path(code_file)
+    test_code = import_statement(code_file, function_name) + test_code
+
+    # Merge the test code into the test module
+    try:
+        tests = merge_tests(output_file, test_code, function_name, replace_existing)
+    except (SyntaxError, ValueError) as e:
+        print(f"\nGenerated tests cannot be written: {e}")
+        if report is not None:
+            report['validation'] = 'invalid'
+        return False, output_file
+    if report is not None:
+        report['validation'] = 'valid'
+        report['tests'] = tests
+        report['node_ids'] = [f"{output_file}::{name}" for name in tests]
+    print(f"{len(tests)} tests written to {output_file}")
+    return True, output_file
+
+
+def test_file_path(code_file: Path) -> Path:
+    """Return the path of the test module that holds the tests for a Python file."""
+
+    return code_file.parent.parent / 'tests' / f"test_{code_file.stem}.py"
+
+
+def import_statement(code_file: Path, function_name: str) -> str:
+    """Return the statement that imports the function or class under test, or the class of a method."""
+
+    return f"from {code_file.parent.name}.{code_file.stem} import {function_name.split('.')[0]}\n\n"
+
+
+def prompt_hash(structured: bool = False) -> str:
+    """Hash of the prompt template, to tell the runs of different prompts apart in the history."""
+
+    return hashlib.sha256(build_prompt("", structured).encode('utf-8')).hexdigest()
+
+
+def build_prompt(code: str, structured: bool = False, instructions: Optional[str] = None) -> str:
+    """Build the generation prompt for the given code."""
+
     prompt = f"""
 Generate comprehensive pytest unit tests for the following Python code:
 
@@ -35,45 +230,84 @@ The tests should:
 5. Follow pytest best practices
 6. Be ready to run without modifications
 """
-    
-    # Generate tests using Ollama
-    print("\n" + "="* 30 + f" Klara is creating the unittest for {function_name} " + "="*30)
-    print(f"Generating tests for {function_name} in {code_file}...")
-    print("This may take a moment depending on the size of your code...\n")
-    print("="*30 + " Klara's response " + "="*30)
-    response = ""
-    for chunk in ollama.generate(model='klaradvn:latest', prompt=prompt, stream=True):
-        response += chunk['response']
-        print(chunk['response'], end='', flush=True)
-    # Extract the test code
-    generated_content = response
-    
+    if instructions:
+        prompt += instructions
+    if structured:
+        prompt += """
+Respond with JSON only. Return one object per test function in `tests` with:
+- `name`: the name of the test function, starting with `test_`
+- `body`: the complete test function definition, including decorators
+- `imports`: the import statements the test needs, one statement per item
+"""
+    return prompt
+
+
+def extract_test_code(response: str) -> str:
+    """Extract the test code from a free-form model response."""
+
     # Find the test code (usually between code blocks)
-    test_code_match = re.search(r'```python\s*(.*?)\s*```', generated_content, re.DOTALL)
+    # The closing fence is missing when generation hit the token limit
+    test_code_match = re.search(r'```python\s*(.*?)\s*(?:```|$)', response, re.DOTALL)
     
     if test_code_match:
-        test_code = test_code_match.group(1)
-    else:
-        # Just use the full response if no code blocks found, but try to clean it up
-        test_code = generated_content
-        if not test_code.startswith("import"):
-            # Try to find where the code actually starts
-            import_match = re.search(r'(import \w+|from \w+ import)', test_code)
-            if import_match:
-                start_pos = import_match.start()
-                test_code = test_code[start_pos:]
-    import_statement_function = f"\nfrom {code_file.parent.name}.{code_file.stem} import {function_name}\n\n"
-    test_code = import_statement_function + test_code
-    # Determine output file name if not specified
-    output_file = code_file.parent.parent / 'tests' / f"test_{code_file.stem}.py"
-    
-    # Write the test code to file
-    # try:
-    with open(str(output_file), "a") as f:
-        f.write(test_code)
-    print(f"Tests written to {output_file}")
-    return True, output_file
-    # except Exception as e:
-    #     print(f"Error writing test file: {e}")
-    #     return False, ""
+        return test_code_match.group(1)
+
+    # Just use the full response if no code blocks found, but try to clean it up
+    test_code = response
+    if not test_code.startswith("import"):
+        # Try to find where the code actually starts
+        import_match = re.search(r'(import \w+|from \w+ import)', test_code)
+        if import_match:
+            start_pos = import_match.start()
+            test_code = test_code[start_pos:]
+    return test_code
+
+
+def _print_metrics(metrics: Dict[str, Any]) -> None:
+    """Print a one-line summary of the generation metrics."""
+
+    ttft = metrics['time_to_first_token']
+    summary = (f"\n\nPrompt tokens: {metrics.get('prompt_tokens')}, "
+               f"output tokens: {metrics.get('output_tokens')}/{metrics['num_predict']}, "
+               f"time to first token: {'-' if ttft is None else f'{ttft:.2f}s'}, "
+               f"total: {metrics['total_latency']:.2f}s")
+    if metrics.get('done_reason') == 'length':
+        summary += " (output truncated at the token limit)"
+    print(summary)
+
+
+def assemble_structured_tests(response: str) -> str:
+    """
+    Assemble test code from a response that follows `STRUCTURED_TESTS_SCHEMA`.
+
+    Imports are deduplicated across tests and placed on top. A body that only
+    holds statements is wrapped in a function definition using the test name.
+
+    Raises:
+        ValueError: If the response is not valid JSON or contains no tests
+    """
+
+    try:
+        data = json.loads(response)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Response is not valid JSON: {e}") from e
+
+    tests = data.get('tests') if isinstance(data, dict) else None
+    if not tests:
+        raise ValueError("Response contains no tests")
+
+    imports = []
+    definitions = []
+    for test in tests:
+        for statement in test.get('imports', []):
+            statement = statement.strip()
+            if statement and statement not in imports:
+                imports.append(statement)
+
+        body = textwrap.dedent(test['body']).strip()
+        if not body.startswith(('def ', 'async def ', '@')):
+            name = test['name'] if test['name'].startswith('test') else f"test_{test['name']}"
+            body = f"def {name}():\n" + textwrap.indent(body, '    ')
+        definitions.append(body)
 
+    return '\n'.join(imports) + '\n\n\n' + '\n\n\n'.join(definitions) + '\n'
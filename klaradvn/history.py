@@ -0,0 +1,201 @@
+import time
+import sqlite3
+import hashlib
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from klaradvn.client import MODEL
+from klaradvn.paths import CACHE_DIR
+
+HISTORY_FILE = 'history.sqlite'
+MODELFILE = Path(__file__).parent / 'template.modelfile'
+
+# Metrics summarized by `summarize_runs`, with True when a higher value is better
+METRICS = {
+    'time_to_first_token': False,
+    'total_latency': False,
+    'prompt_tokens': False,
+    'output_tokens': False,
+    'test_duration': False,
+    'valid_rate': True,
+    'pass_rate': True,
+}
+PERCENTILES = (50, 90, 95)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp REAL NOT NULL,
+    symbol TEXT NOT NULL,
+    source_hash TEXT NOT NULL,
+    model TEXT,
+    modelfile_hash TEXT,
+    prompt_hash TEXT,
+    structured INTEGER,
+    prompt_tokens INTEGER,
+    output_tokens INTEGER,
+    time_to_first_token REAL,
+    total_latency REAL,
+    validation TEXT,
+    tests INTEGER,
+    passed INTEGER,
+    failed INTEGER,
+    test_duration REAL
+)
+"""
+
+
+def record_run(symbol: str, code: str, report: Dict[str, Any], structured: bool = False, db_path: Optional[Path] = None) -> Optional[int]:
+    """
+    Record a generation run in the run history.
+
+    Args:
+        symbol: Name of the function or class the tests were generated for
+        code: Source code of the function or class
+        report: Report of the run as filled by `generate_tests`
+        structured: Whether the structured-output mode was used
+        db_path: Path of the SQLite database, defaults to `.klaradvn/history.sqlite`
+            in the working directory
+
+    Returns:
+        The ID of the recorded run, None if the history could not be written
+    """
+
+    row = {
+        'timestamp': time.time(),
+        'symbol': symbol,
+        'source_hash': hashlib.sha256(code.encode('utf-8')).hexdigest(),
+        'model': MODEL,
+        'modelfile_hash': _modelfile_hash(),
+        'prompt_hash': report.get('prompt_hash'),
+        'structured': int(structured),
+        'prompt_tokens': report.get('prompt_tokens'),
+        'output_tokens': report.get('output_tokens'),
+        'time_to_first_token': report.get('time_to_first_token'),
+        'total_latency': report.get('total_latency'),
+        'validation': report.get('validation'),
+        'tests': len(report['tests']) if 'tests' in report else None,
+    }
+    try:
+        with _connect(db_path) as connection:
+            cursor = connection.execute(f"INSERT INTO runs ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})", list(row.values()))
+            return cursor.lastrowid
+    except (sqlite3.Error, OSError) as e:
+        print(f"Could not record the run in the history: {e}")
+        return None
+
+
+def record_test_results(run_id: int, results: Dict[str, Dict[str, Any]], db_path: Optional[Path] = None) -> None:
+    """
+    Add the outcome of the generated tests to a recorded run.
+
+    Args:
+        run_id: ID of the run as returned by `record_run`
+        results: Results of the tests as returned by `run_tests`
+        db_path: Path of the SQLite database, see `record_run`
+    """
+
+    outcomes = [r['outcome'] for r in results.values()]
+    passed = outcomes.count('passed')
+    failed = sum(outcome in ('failed', 'error', 'timeout') for outcome in outcomes)
+    duration = sum(r.get('duration') or 0 for r in results.values())
+    try:
+        with _connect(db_path) as connection:
+            connection.execute("UPDATE runs SET passed = ?, failed = ?, test_duration = ? WHERE id = ?", (passed, failed, duration, run_id))
+    except (sqlite3.Error, OSError) as e:
+        print(f"Could not record the test results in the history: {e}")
+
+
+def load_runs(db_path: Optional[Path] = None, symbol: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Load the recorded runs, oldest first.
+
+    Args:
+        db_path: Path of the SQLite database, see `record_run`
+        symbol: Only load the runs of this function or class
+
+    Returns:
+        List with a dictionary per run, holding the columns of the `runs` table
+    """
+
+    with _connect(db_path) as connection:
+        connection.row_factory = sqlite3.Row
+        query = "SELECT * FROM runs" + (" WHERE symbol = ?" if symbol else "") + " ORDER BY id"
+        return [dict(row) for row in connection.execute(query, (symbol,) if symbol else ())]
+
+
+def summarize_runs(runs: List[Dict[str, Any]], window: int = 20, baseline: int = 100, threshold: float = 0.2) -> Dict[str, Dict[str, Any]]:
+    """
+    Compare the most recent runs with the runs before them.
+
+    Args:
+        runs: Runs as returned by `load_runs`, oldest first
+        window: Number of most recent runs to summarize
+        baseline: Number of runs before the window to compare with
+        threshold: Relative change of the median that counts as a regression
+
+    Returns:
+        Dictionary mapping every metric of `METRICS` to a dictionary with the
+        percentiles of the 'recent' and the 'baseline' runs (None without data),
+        and whether the metric 'regressed'. Rates only have the 'p50' value,
+        which is the rate over all runs of the window.
+    """
+
+    recent_runs = runs[-window:] if window else []
+    baseline_runs = runs[-window - baseline:-window] if window else runs[-baseline:]
+    summary = {}
+    for metric, higher_is_better in METRICS.items():
+        recent, base = _aggregate(recent_runs, metric), _aggregate(baseline_runs, metric)
+        regressed = False
+        if recent['p50'] is not None and base['p50'] is not None:
+            if higher_is_better:
+                regressed = recent['p50'] < base['p50'] * (1 - threshold)
+            else:
+                regressed = recent['p50'] > base['p50'] * (1 + threshold)
+        summary[metric] = {'recent': recent, 'baseline': base, 'regressed': regressed}
+    return summary
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Return the `q`-th percentile of the values with linear interpolation, None without values."""
+
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def _aggregate(runs: List[Dict[str, Any]], metric: str) -> Dict[str, Optional[float]]:
+    if metric == 'valid_rate':
+        judged = [r for r in runs if r['validation'] in ('valid', 'invalid', 'no response')]
+        return {'p50': sum(r['validation'] == 'valid' for r in judged) / len(judged) if judged else None}
+    if metric == 'pass_rate':
+        tested = [r for r in runs if r['passed'] is not None]
+        total = sum(r['passed'] + r['failed'] for r in tested)
+        return {'p50': sum(r['passed'] for r in tested) / total if total else None}
+    values = [r[metric] for r in runs if r[metric] is not None]
+    return {f"p{q}": percentile(values, q) for q in PERCENTILES}
+
+
+@contextmanager
+def _connect(db_path: Optional[Path]) -> Iterator[sqlite3.Connection]:
+    db_path = db_path or Path.cwd() / CACHE_DIR / HISTORY_FILE
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(db_path, timeout=30)
+    try:
+        with connection:
+            connection.execute(_SCHEMA)
+            yield connection
+    finally:
+        connection.close()
+
+
+def _modelfile_hash() -> Optional[str]:
+    try:
+        return hashlib.sha256(MODELFILE.read_bytes()).hexdigest()
+    except OSError:
+        return None
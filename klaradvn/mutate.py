@@ -0,0 +1,225 @@
+import os
+import ast
+import sys
+import copy
+import time
+import types
+import signal
+import importlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Replacements per operator type, every replacement is a separate mutant
+COMPARE_MUTATIONS = {
+    ast.Gt: (ast.GtE, ast.LtE), ast.GtE: (ast.Gt, ast.Lt),
+    ast.Lt: (ast.LtE, ast.GtE), ast.LtE: (ast.Lt, ast.Gt),
+    ast.Eq: (ast.NotEq,), ast.NotEq: (ast.Eq,),
+    ast.Is: (ast.IsNot,), ast.IsNot: (ast.Is,),
+    ast.In: (ast.NotIn,), ast.NotIn: (ast.In,),
+}
+BINOP_MUTATIONS = {
+    ast.Add: (ast.Sub,), ast.Sub: (ast.Add,),
+    ast.Mult: (ast.Div,), ast.Div: (ast.Mult,),
+    ast.FloorDiv: (ast.Div,), ast.Mod: (ast.FloorDiv,),
+}
+BOOLOP_MUTATIONS = {ast.And: (ast.Or,), ast.Or: (ast.And,)}
+
+OPERATOR_SYMBOLS = {
+    ast.Gt: '>', ast.GtE: '>=', ast.Lt: '<', ast.LtE: '<=', ast.Eq: '==', ast.NotEq: '!=',
+    ast.Is: 'is', ast.IsNot: 'is not', ast.In: 'in', ast.NotIn: 'not in',
+    ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/', ast.FloorDiv: '//', ast.Mod: '%',
+    ast.And: 'and', ast.Or: 'or',
+}
+
+# Exit code of a worker whose tests all passed
+EXIT_SURVIVED = 0
+
+
+def generate_mutants(source_code: str, lineno: int, end_lineno: int) -> List[Dict[str, Any]]:
+    """
+    Create AST mutants of the code within a line span of a module.
+
+    Comparison, arithmetic and boolean operators are replaced, `not` is removed
+    and numeric and boolean constants are changed, one mutation per mutant.
+
+    Args:
+        source_code: Source code of the complete module
+        lineno: First line of the function or class to mutate (1-indexed)
+        end_lineno: Last line of the function or class
+
+    Returns:
+        List of mutants, each a dictionary with the mutated module 'tree', the
+        'lineno' of the mutation and a 'description'
+    """
+
+    tree = ast.parse(source_code)
+    docstrings = {id(n.body[0].value) for n in ast.walk(tree)
+                  if isinstance(n, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef))
+                  and n.body and isinstance(n.body[0], ast.Expr)}
+    mutations = []
+    for index, node in enumerate(ast.walk(tree)):
+        if getattr(node, 'lineno', 0) < lineno or getattr(node, 'end_lineno', 0) > end_lineno or id(node) in docstrings:
+            continue
+        mutations.extend((index, description, mutate) for description, mutate in _mutations(node))
+
+    mutants = []
+    for index, description, mutate in mutations:
+        mutant = copy.deepcopy(tree)
+        node = next(n for i, n in enumerate(ast.walk(mutant)) if i == index)
+        lineno_ = node.lineno
+        mutate(node)
+        mutants.append({'tree': ast.fix_missing_locations(mutant), 'lineno': lineno_, 'description': description})
+    return mutants
+
+
+def _mutations(node: ast.AST) -> List[Tuple[str, Any]]:
+    """List the possible mutations of a node as (description, function mutating a copy) pairs."""
+
+    mutations = []
+    if isinstance(node, ast.Compare):
+        for i, op in enumerate(node.ops):
+            for replacement in COMPARE_MUTATIONS.get(type(op), ()):
+                mutations.append((_describe(op, replacement), lambda n, i=i, r=replacement: n.ops.__setitem__(i, r())))
+    elif isinstance(node, (ast.BinOp, ast.AugAssign, ast.BoolOp)):
+        replacements = BOOLOP_MUTATIONS if isinstance(node, ast.BoolOp) else BINOP_MUTATIONS
+        for replacement in replacements.get(type(node.op), ()):
+            mutations.append((_describe(node.op, replacement), lambda n, r=replacement: setattr(n, 'op', r())))
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        # Wrapping the operand in `not not` keeps the node type but removes the negation
+        mutations.append(("not x -> x", lambda n: setattr(n, 'operand', ast.UnaryOp(ast.Not(), n.operand))))
+    elif isinstance(node, ast.Constant):
+        if isinstance(node.value, bool):
+            mutations.append((f"{node.value} -> {not node.value}", lambda n: setattr(n, 'value', not n.value)))
+        elif isinstance(node.value, (int, float)):
+            mutations.append((f"{node.value!r} -> {node.value + 1!r}", lambda n: setattr(n, 'value', n.value + 1)))
+    return mutations
+
+
+def _describe(op: ast.AST, replacement: type) -> str:
+    return f"{OPERATOR_SYMBOLS[type(op)]} -> {OPERATOR_SYMBOLS[replacement]}"
+
+
+def score_tests(file_path: Path, lineno: int, end_lineno: int, node_ids: List[str], timeout: float = 10.0, workers: Optional[int] = None, extra_args: Sequence[str] = ()) -> Dict[str, Any]:
+    """
+    Score tests by the fraction of mutants of the code under test they kill.
+
+    Every mutant is compiled in memory and installed in `sys.modules` of a
+    forked worker, which then runs only the given tests with pytest. pytest is
+    imported once before forking so the workers start warm.
+
+    Args:
+        file_path: Python file containing the function or class under test
+        lineno: First line of the function or class (1-indexed)
+        end_lineno: Last line of the function or class
+        node_ids: pytest node IDs of the tests to score
+        timeout: Seconds after which a worker is killed, which counts as a kill
+        workers: Maximum number of concurrent workers, defaults to the number of CPUs
+        extra_args: Additional command line arguments for pytest
+
+    Returns:
+        Dictionary with the number of 'mutants', 'killed' and 'timeouts', the
+        'survived' mutants as (line, description) pairs and the kill rate as 'score'
+
+    Raises:
+        RuntimeError: If forking is not supported or the tests fail without mutations
+    """
+
+    if not hasattr(os, 'fork'):
+        raise RuntimeError("Mutation scoring requires os.fork, which is not available on this platform")
+    import pytest  # noqa: F401, warm up the workers
+
+    file_path = Path(file_path).resolve()
+    module_name, root = _module_name(file_path)
+    source_code = file_path.read_text(encoding='utf-8')
+    pytest_args = [*node_ids, '-x', '-q', '-p', 'no:cacheprovider', *extra_args]
+
+    baseline = _run_workers([ast.parse(source_code)], file_path, module_name, root, pytest_args, timeout, 1)
+    if baseline != [EXIT_SURVIVED]:
+        raise RuntimeError("The tests do not pass (or were not found) on the original code, so they cannot be scored")
+
+    mutants = generate_mutants(source_code, lineno, end_lineno)
+    exit_codes = _run_workers([m['tree'] for m in mutants], file_path, module_name, root, pytest_args, timeout, workers or os.cpu_count() or 1)
+    survived = [(m['lineno'], m['description']) for m, code in zip(mutants, exit_codes) if code == EXIT_SURVIVED]
+    timeouts = sum(code is None for code in exit_codes)
+    result = {
+        'mutants': len(mutants),
+        'killed': len(mutants) - len(survived),
+        'timeouts': timeouts,
+        'survived': survived,
+        'score': (len(mutants) - len(survived)) / len(mutants) if mutants else 1.0,
+    }
+    print(f"Killed {result['killed']}/{result['mutants']} mutants ({result['score']:.0%}), {timeouts} by timeout")
+    for line, description in survived:
+        print(f"  survived: line {line}: {description}")
+    return result
+
+
+def _module_name(file_path: Path) -> Tuple[str, Path]:
+    """Derive the dotted module name and the import root of a Python file from its packages."""
+
+    parts = [file_path.stem]
+    root = file_path.parent
+    while (root / '__init__.py').exists():
+        parts.insert(0, root.name)
+        root = root.parent
+    return '.'.join(parts), root
+
+
+def _run_workers(trees: List[ast.Module], file_path: Path, module_name: str, root: Path, pytest_args: List[str], timeout: float, workers: int) -> List[Optional[int]]:
+    """Run the tests against every module tree in a forked worker; None marks a timeout."""
+
+    exit_codes: List[Optional[int]] = [None] * len(trees)
+    running: Dict[int, Tuple[int, float]] = {}
+    pending = list(range(len(trees)))
+    while pending or running:
+        while pending and len(running) < workers:
+            index = pending.pop(0)
+            pid = os.fork()
+            if pid == 0:
+                _worker(trees[index], file_path, module_name, root, pytest_args)
+            running[pid] = (index, time.monotonic() + timeout)
+
+        # Only wait for our own workers, other children of the process are none of our business
+        reaped = False
+        for pid, (index, deadline) in list(running.items()):
+            finished, status = os.waitpid(pid, os.WNOHANG)
+            if finished:
+                exit_codes[index] = os.waitstatus_to_exitcode(status)
+                del running[pid]
+                reaped = True
+            elif time.monotonic() > deadline:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+                del running[pid]
+        if not reaped:
+            time.sleep(0.005)
+    return exit_codes
+
+
+def _worker(tree: ast.Module, file_path: Path, module_name: str, root: Path, pytest_args: List[str]) -> None:
+    """Install the module compiled from `tree` and run pytest; never returns."""
+
+    exit_code = 1
+    try:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        sys.path.insert(0, str(root))
+        package, _, leaf = module_name.rpartition('.')
+        module = types.ModuleType(module_name)
+        module.__file__ = str(file_path)
+        module.__package__ = package
+        if package:
+            importlib.import_module(package)
+        sys.modules[module_name] = module
+        exec(compile(tree, str(file_path), 'exec'), module.__dict__)
+        if package:
+            setattr(sys.modules[package], leaf, module)
+
+        import pytest
+        exit_code = int(pytest.main(pytest_args))
+    except BaseException:
+        # A mutant that cannot even be imported is killed by any test
+        exit_code = 1
+    finally:
+        os._exit(exit_code)
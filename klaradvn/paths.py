@@ -0,0 +1,2 @@
+# Directory in the project where Klara keeps its caches, run history and reports
+CACHE_DIR = '.klaradvn'
@@ -0,0 +1,167 @@
+import io
+import time
+import pstats
+import cProfile
+import itertools
+import threading
+import tracemalloc
+from pathlib import Path
+from dataclasses import dataclass, field
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from klaradvn.paths import CACHE_DIR
+
+Hook = Callable[[str, Dict[str, Any]], None]
+
+
+@dataclass
+class ProfileConfig:
+    """
+    What to measure for every stage of a run and where to write the reports.
+
+    With `profile` every stage runs under cProfile, with `trace_memory` the
+    allocations of every stage are traced with tracemalloc. `top` is the number
+    of hot spots and allocation sites in the reports.
+    """
+
+    profile: bool = False
+    trace_memory: bool = False
+    output_dir: Path = field(default_factory=lambda: Path(CACHE_DIR) / 'profiles')
+    top: int = 25
+
+
+_config = ProfileConfig()
+_hooks: List[Hook] = []
+_active = False
+_counter = itertools.count(1)
+_lock = threading.Lock()
+
+
+def configure(config: Optional[ProfileConfig] = None) -> None:
+    """Set what is measured per stage, `None` turns profiling and memory tracing off."""
+
+    global _config
+    _config = config or ProfileConfig()
+
+
+def add_hook(hook: Hook) -> None:
+    """
+    Register a function that is called with the name and the report of every finished stage.
+
+    The report holds the 'duration' in seconds and, when enabled, the 'hotspots'
+    and the 'allocations' of the stage, see `stage`.
+    """
+
+    _hooks.append(hook)
+
+
+def remove_hook(hook: Hook) -> None:
+    """Unregister a function registered with `add_hook`."""
+
+    _hooks.remove(hook)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[Dict[str, Any]]:
+    """
+    Measure a stage of a run according to the configuration set with `configure`.
+
+    A stage started while another stage runs is measured as part of that stage
+    only, as cProfile cannot run twice at the same time. Note that cProfile only
+    sees the thread that entered the stage.
+
+    Args:
+        name: Name of the stage, used for the report file names
+
+    Yields:
+        The report of the stage, filled when the stage ends with:
+        - 'duration': Wall-clock duration in seconds
+        - 'hotspots': Functions with the highest cumulative time, with 'function',
+          'calls', 'total_time' and 'cumulative_time' (with `profile`)
+        - 'peak_memory': Peak traced memory in bytes (with `trace_memory`)
+        - 'allocations': Source lines that allocated the most memory, with
+          'location', 'size' and 'count' (with `trace_memory`)
+        - 'report': Path of the text report (with `profile` or `trace_memory`)
+    """
+
+    global _active
+    report: Dict[str, Any] = {}
+    config = _config
+    if not (config.profile or config.trace_memory or _hooks):
+        yield report
+        return
+    with _lock:
+        nested, _active = _active, True
+    if nested:
+        yield report
+        return
+
+    profiler = cProfile.Profile() if config.profile else None
+    started_tracing = config.trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(10)
+    if config.trace_memory:
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+    start = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        yield report
+    finally:
+        if profiler:
+            profiler.disable()
+        report['duration'] = time.perf_counter() - start
+        _active = False
+        text = []
+        if config.trace_memory:
+            # Snapshot before the profile statistics are processed, which allocate as well
+            report['peak_memory'] = tracemalloc.get_traced_memory()[1]
+            report['allocations'], memory_text = _allocations(before, tracemalloc.take_snapshot(), report['peak_memory'], config.top)
+            if started_tracing:
+                tracemalloc.stop()
+        if profiler:
+            report['hotspots'], profile_text = _hotspots(profiler, config.top)
+            text.append(profile_text)
+        if config.trace_memory:
+            text.append(memory_text)
+        if text:
+            report['report'] = _write_report(name, config, profiler, text)
+        for hook in list(_hooks):
+            hook(name, report)
+
+
+def _hotspots(profiler: cProfile.Profile, top: int) -> tuple:
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream).sort_stats(pstats.SortKey.CUMULATIVE)
+    stats.print_stats(top)
+    hotspots = []
+    for (file_name, line, function), (_, calls, total_time, cumulative_time, _) in stats.stats.items():
+        hotspots.append({'function': f"{file_name}:{line}({function})", 'calls': calls,
+                         'total_time': total_time, 'cumulative_time': cumulative_time})
+    hotspots.sort(key=lambda h: h['cumulative_time'], reverse=True)
+    return hotspots[:top], stream.getvalue()
+
+
+def _allocations(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, peak: int, top: int) -> tuple:
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+    differences = after.filter_traces(filters).compare_to(before.filter_traces(filters), 'lineno')
+    differences = [d for d in differences if d.size_diff > 0][:top]
+    allocations = [{'location': f"{d.traceback[0].filename}:{d.traceback[0].lineno}", 'size': d.size_diff, 'count': d.count_diff}
+                   for d in differences]
+    lines = [f"Peak memory {peak / 1024:.0f} KiB, top {len(allocations)} allocations"] + [str(d) for d in differences]
+    return allocations, '\n'.join(lines) + '\n'
+
+
+def _write_report(name: str, config: ProfileConfig, profiler: Optional[cProfile.Profile], text: List[str]) -> Path:
+    with _lock:
+        index = next(_counter)
+    config.output_dir.mkdir(parents=True, exist_ok=True)
+    base = config.output_dir / f"{index:03d}-{name}"
+    if profiler:
+        # Binary stats for further analysis with pstats or snakeviz
+        profiler.dump_stats(base.with_suffix('.prof'))
+    report_path = base.with_suffix('.txt')
+    report_path.write_text('\n'.join(text), encoding='utf-8')
+    return report_path
@@ -0,0 +1,260 @@
+"""
+pytest plugin that generates the missing tests of a project during collection.
+
+With `--klara-generate` the public functions and classes in the source roots
+(`--klara-source-root` or the `klara_source_roots` ini option, the packages in
+the rootdir or in its `src` directory by default) that have no tests in their
+test module are looked up, their tests are generated concurrently and collected
+straight from memory. Symbols whose test module would be outside the rootdir
+are skipped. The generated
+tests run in the same session as the existing tests, so the code under test is
+only imported once. The runs and the results of their tests are recorded in
+the history in `.klaradvn` of the rootdir. With `--klara-write` the generated
+tests that passed are written to the test modules at the end of the session.
+
+The plugin is registered for every pytest run of an environment where Klara is
+installed, so Klara itself is only imported once `--klara-generate` is given.
+"""
+import ast
+import sys
+import types
+import linecache
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import pytest
+
+try:
+    from _pytest.assertion.rewrite import rewrite_asserts
+except ImportError:  # Private API of pytest, plain asserts still work without it
+    rewrite_asserts = None
+
+_generated = pytest.StashKey[List['GeneratedModule']]()
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('klara', 'generate missing tests with Klara')
+    group.addoption('--klara-generate', action='store_true', default=False,
+                    help="Generate the tests of untested functions and classes and run them from memory")
+    group.addoption('--klara-source-root', action='append', default=[], type=Path,
+                    help="Directory with the code to generate tests for, can be repeated")
+    group.addoption('--klara-workers', type=int, default=4,
+                    help="Number of concurrent generations")
+    group.addoption('--klara-write', action='store_true', default=False,
+                    help="Write the generated tests that passed to the test modules")
+    parser.addini('klara_source_roots', "Directories with the code to generate tests for", type='paths', default=[])
+
+
+class GeneratedModule(pytest.Module):
+    """Test module whose source only exists in memory."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.source = ""
+        self.code_file: Optional[Path] = None
+        self.symbol = ""
+        self.test_code = ""
+        self.tests: Set[str] = set()
+        self.failed: Set[str] = set()
+        self.run_id: Optional[int] = None
+        self.results: Dict[str, Dict[str, Any]] = {}
+
+    def _getobj(self):
+        filename = str(self.path)
+        # Let tracebacks and inspect find the source of the module
+        linecache.cache[filename] = (len(self.source), None, self.source.splitlines(True), filename)
+        tree = ast.parse(self.source, filename)
+        if rewrite_asserts is not None:
+            try:
+                rewrite_asserts(tree, self.source.encode('utf-8'), self.path, self.config)
+            except TypeError:
+                # The signature of the private API changed, keep the plain asserts
+                pass
+        module = types.ModuleType(f"klaradvn_generated.{self.path.stem}")
+        module.__file__ = filename
+        sys.modules[module.__name__] = module
+        exec(compile(tree, filename, 'exec'), module.__dict__)
+        return module
+
+
+def untested_symbols(source_roots: List[Path]) -> List[Tuple[Path, str, str]]:
+    """
+    Find the public functions and classes without tests in their test module.
+
+    Args:
+        source_roots: Directories with the code to generate tests for
+
+    Returns:
+        List of (code_file, source_code, name) tuples
+    """
+
+    from klaradvn.extract import source_files, extract_symbols
+    from klaradvn.generate import test_file_path
+    from klaradvn.writer import symbol_tests
+
+    symbols = []
+    for root in source_roots:
+        for code_file in sorted(source_files(root)):
+            test_file = test_file_path(code_file)
+            for name, symbol in extract_symbols(code_file).items():
+                if name.startswith('_'):
+                    continue
+                if test_file.exists() and symbol_tests(test_file, name):
+                    continue
+                symbols.append((code_file, symbol['source_code'], name))
+    return symbols
+
+
+def package_roots(rootdir: Path) -> List[Path]:
+    """
+    Find the top-level packages of a project.
+
+    Args:
+        rootdir: Root directory of the project
+
+    Returns:
+        The directories with an `__init__.py` directly in `rootdir` or in its
+        `src` directory, except the test packages
+    """
+
+    from klaradvn.extract import SKIPPED_DIRS
+
+    roots = []
+    for parent in (rootdir, rootdir / 'src'):
+        if not parent.is_dir():
+            continue
+        for path in sorted(parent.iterdir()):
+            if (path.is_dir() and (path / '__init__.py').exists() and path.name not in ('tests', 'test')
+                    and not path.name.startswith('.') and path.name not in SKIPPED_DIRS):
+                roots.append(path)
+    return roots
+
+
+def collect_generated_tests(session: pytest.Session, code_file: Path, name: str, test_code: str) -> List[pytest.Item]:
+    """
+    Collect generated tests of a function or class from memory.
+
+    The tests get a module path of their own next to the test module of
+    `code_file` (`tests/test_<module>.<name>.py`), so their node IDs do not
+    clash with the tests that already exist.
+
+    Args:
+        session: The pytest session
+        code_file: Path to the Python file the tests were generated for
+        name: Name of the function or class the tests were generated for
+        test_code: Generated test code, without the import of the function or class
+
+    Returns:
+        The collected test items
+    """
+
+    from klaradvn.generate import import_statement, test_file_path
+
+    test_file = test_file_path(code_file)
+    module = GeneratedModule.from_parent(session, path=test_file.with_name(f"{test_file.stem}.{name}.py"))
+    module.code_file, module.symbol, module.test_code = code_file, name, test_code
+    module.source = import_statement(code_file, name) + test_code
+    items = list(session.genitems(module))
+    module.tests = {_top_level_name(item, module) for item in items}
+    session.config.stash.setdefault(_generated, []).append(module)
+    return items
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_collection_modifyitems(session, config, items):
+    if not config.getoption('klara_generate'):
+        return
+    from klaradvn.generate import generate_test_code, test_file_path
+    from klaradvn.history import HISTORY_FILE, record_run
+    from klaradvn.paths import CACHE_DIR
+
+    source_roots = config.getoption('klara_source_root') or config.getini('klara_source_roots') or package_roots(config.rootpath)
+    symbols = []
+    for code_file, code, name in untested_symbols([Path(root) for root in source_roots]):
+        if _inside(test_file_path(code_file), config.rootpath):
+            symbols.append((code_file, code, name))
+        else:
+            print(f"\nSkipping {name}, its test module {test_file_path(code_file)} would be outside the rootdir")
+    if not symbols:
+        return
+
+    def generate(symbol: Tuple[Path, str, str]) -> Tuple[Optional[str], Dict[str, Any]]:
+        code_file, code, name = symbol
+        report = {}
+        return generate_test_code(code, name, echo=False, report=report), report
+
+    with ThreadPoolExecutor(config.getoption('klara_workers')) as pool:
+        generations = list(pool.map(generate, symbols))
+
+    for (code_file, code, name), (test_code, report) in zip(symbols, generations):
+        module = None
+        if test_code is not None:
+            try:
+                ast.parse(test_code)
+            except SyntaxError as e:
+                print(f"\nGenerated tests for {name} are not valid Python: {e}")
+                report['validation'] = 'invalid'
+            else:
+                items.extend(collect_generated_tests(session, code_file, name, test_code))
+                module = config.stash[_generated][-1]
+                report['validation'] = 'valid'
+                report['tests'] = sorted(module.tests)
+        # Cancelled runs are not recorded
+        if report.get('validation') != 'cancelled':
+            run_id = record_run(name, code, report, db_path=config.rootpath / CACHE_DIR / HISTORY_FILE)
+            if module is not None:
+                module.run_id = run_id
+
+
+@pytest.hookimpl(wrapper=True)
+def pytest_runtest_makereport(item, call):
+    report = yield
+    module = item.getparent(GeneratedModule)
+    if module is not None:
+        result = module.results.setdefault(item.nodeid, {'outcome': 'passed', 'duration': 0.0})
+        result['duration'] += report.duration
+        if report.failed:
+            module.failed.add(_top_level_name(item, module))
+            result['outcome'] = 'failed'
+        elif report.skipped and result['outcome'] == 'passed':
+            result['outcome'] = 'skipped'
+    return report
+
+
+def pytest_sessionfinish(session):
+    modules = session.config.stash.get(_generated, [])
+    if any(module.run_id is not None for module in modules):
+        from klaradvn.history import HISTORY_FILE, record_test_results
+        from klaradvn.paths import CACHE_DIR
+
+        for module in modules:
+            if module.run_id is not None and module.results:
+                record_test_results(module.run_id, module.results, session.config.rootpath / CACHE_DIR / HISTORY_FILE)
+    if not session.config.getoption('klara_write', default=False):
+        return
+    from klaradvn.generate import test_file_path, write_tests
+    from klaradvn.writer import remove_tests
+
+    for module in modules:
+        if not module.tests - module.failed:
+            continue
+        if not _inside(test_file_path(module.code_file), session.config.rootpath):
+            print(f"\nNot writing the tests of {module.symbol} outside the rootdir")
+            continue
+        report = {}
+        success, test_file = write_tests(module.code_file, module.test_code, module.symbol, report=report)
+        if success and module.failed:
+            remove_tests(test_file, [test for test in report['tests'] if test in module.failed])
+
+
+def _inside(path: Path, root: Path) -> bool:
+    return path.resolve().is_relative_to(root.resolve())
+
+
+def _top_level_name(item: pytest.Item, module: GeneratedModule) -> str:
+    """Name of the test function or class in the module that an item belongs to."""
+
+    chain = item.listchain()
+    node = chain[chain.index(module) + 1]
+    return getattr(node, 'originalname', node.name)
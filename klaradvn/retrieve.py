@@ -0,0 +1,165 @@
+import os
+import hashlib
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+import ollama
+
+from klaradvn.extract import SKIPPED_DIRS
+from klaradvn.paths import CACHE_DIR
+from klaradvn.writer import test_sources
+
+EMBED_MODEL = 'nomic-embed-text'
+INDEX_FILE = 'test_index.npz'
+# Rough size of a token of Python code, used to keep the examples within the token budget
+CHARS_PER_TOKEN = 4
+
+EXAMPLES_INSTRUCTIONS = """
+Write the tests in the style of these existing tests of the project, reusing their fixtures, parametrization and naming:
+
+```python
+{examples}
+```
+"""
+
+Embedder = Callable[[List[str]], Sequence[Sequence[float]]]
+
+
+def update_index(root: Path, cache_dir: Optional[Path] = None, embed: Optional[Embedder] = None) -> Dict[str, np.ndarray]:
+    """
+    Bring the embedding index of the existing tests of a project up to date.
+
+    Every top-level test in the `tests` directories below `root` is a row of the
+    index. Only tests whose source changed since the last update are embedded,
+    the other rows are taken over from the stored index.
+
+    Args:
+        root: Root directory of the project
+        cache_dir: Directory of the index, defaults to `.klaradvn` in `root`
+        embed: Function returning the embeddings of a list of texts, defaults to
+            the `EMBED_MODEL` of ollama
+
+    Returns:
+        Dictionary with the node IDs ('keys'), source 'hashes', 'sources' and the
+        row-normalized embedding 'matrix' of the tests
+    """
+
+    embed = embed or _ollama_embed
+    index_path = (cache_dir or root / CACHE_DIR) / INDEX_FILE
+    index = _load_index(index_path)
+    rows = {h: row for h, row in zip(index['hashes'], index['matrix'])}
+
+    tests = collect_tests(root)
+    hashes = [hashlib.sha256(source.encode('utf-8')).hexdigest() for source in tests.values()]
+    missing = {h: source for h, source in zip(hashes, tests.values()) if h not in rows}
+    if missing:
+        vectors = _normalize(np.asarray(embed(list(missing.values())), dtype=np.float32))
+        if any(row.shape != vectors[0].shape for row in rows.values()):
+            # The embedding model changed, the stored rows are not comparable anymore
+            missing = dict(zip(hashes, tests.values()))
+            vectors = _normalize(np.asarray(embed(list(missing.values())), dtype=np.float32))
+        rows.update(zip(missing, vectors))
+
+    updated = {
+        'keys': np.array(list(tests), dtype=str),
+        'hashes': np.array(hashes, dtype=str),
+        'sources': np.array(list(tests.values()), dtype=str),
+        'matrix': np.stack([rows[h] for h in hashes]) if hashes else np.zeros((0, 0), dtype=np.float32),
+    }
+    if missing or list(updated['keys']) != list(index['keys']) or list(updated['hashes']) != list(index['hashes']):
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(index_path, 'wb') as f:
+            np.savez(f, **updated)
+    return updated
+
+
+def similar_tests(code: str, root: Path, k: int = 3, token_budget: int = 1024, cache_dir: Optional[Path] = None, embed: Optional[Embedder] = None) -> List[str]:
+    """
+    Retrieve the existing tests that are most similar to the code under test.
+
+    Args:
+        code: Source code of the function or class to test
+        root: Root directory of the project
+        k: Maximum number of tests to return
+        token_budget: Maximum number of tokens of all returned tests together
+        cache_dir: Directory of the index, defaults to `.klaradvn` in `root`
+        embed: Function returning the embeddings of a list of texts, defaults to
+            the `EMBED_MODEL` of ollama
+
+    Returns:
+        The sources of the most similar tests, most similar first
+    """
+
+    embed = embed or _ollama_embed
+    index = update_index(root, cache_dir, embed)
+    if not len(index['keys']) or k <= 0:
+        return []
+    query = _normalize(np.asarray(embed([code]), dtype=np.float32))[0]
+    similarities = index['matrix'] @ query
+
+    examples = []
+    budget = token_budget * CHARS_PER_TOKEN
+    for i in np.argsort(-similarities):
+        source = str(index['sources'][i])
+        if len(source) <= budget:
+            examples.append(source)
+            budget -= len(source)
+        if len(examples) == k:
+            break
+    return examples
+
+
+def example_instructions(examples: List[str]) -> Optional[str]:
+    """Turn retrieved tests into instructions for the prompt, None without examples."""
+
+    if not examples:
+        return None
+    return EXAMPLES_INSTRUCTIONS.format(examples="\n\n\n".join(examples))
+
+
+def collect_tests(root: Path) -> Dict[str, str]:
+    """
+    Collect the sources of the top-level tests in the `tests` directories of a project.
+
+    Args:
+        root: Root directory of the project
+
+    Returns:
+        Dictionary mapping the node IDs of the tests to their source code
+    """
+
+    tests = {}
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = sorted(d for d in dir_names if not d.startswith('.') and d not in SKIPPED_DIRS)
+        if 'tests' not in Path(dir_path).relative_to(root).parts:
+            continue
+        for file_name in sorted(file_names):
+            if not (file_name.startswith('test_') and file_name.endswith('.py')):
+                continue
+            file_path = Path(dir_path) / file_name
+            try:
+                sources = test_sources(file_path)
+            except (OSError, UnicodeDecodeError, SyntaxError):
+                continue
+            for name, source in sources.items():
+                tests[f"{file_path.relative_to(root)}::{name}"] = source
+    return tests
+
+
+def _ollama_embed(texts: List[str]) -> Sequence[Sequence[float]]:
+    return ollama.embed(model=EMBED_MODEL, input=texts)['embeddings']
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def _load_index(index_path: Path) -> Dict[str, np.ndarray]:
+    try:
+        with np.load(index_path, allow_pickle=False) as data:
+            return {key: data[key] for key in ('keys', 'hashes', 'sources', 'matrix')}
+    except (OSError, ValueError, KeyError):
+        empty = np.array([], dtype=str)
+        return {'keys': empty, 'hashes': empty, 'sources': empty, 'matrix': np.zeros((0, 0), dtype=np.float32)}
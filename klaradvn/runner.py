@@ -0,0 +1,209 @@
+import os
+import sys
+import json
+import hashlib
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from klaradvn.history import record_test_results
+from klaradvn.paths import CACHE_DIR
+from klaradvn.sandbox import SandboxLimits, run_sandboxed
+from klaradvn.sandbox_plugin import REPORT_ENV
+from klaradvn.writer import mark_tests, module_context, remove_tests, test_sources
+
+CACHE_FILE = 'test_results.json'
+
+
+def run_tests(node_ids: List[str], code: str, extra_args: Sequence[str] = (), cache_dir: Optional[Path] = None, limits: Optional[SandboxLimits] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Run only the given tests with pytest in a sandbox, skipping tests with a cached result.
+
+    Results are cached per hash of the test source, the rest of its module
+    (imports, fixtures and helpers), the `conftest.py` files above it, the
+    extra arguments and the code under test, so a test is only executed again
+    when any of them changed.
+
+    Args:
+        node_ids: pytest node IDs of top-level tests (`path::test_name`)
+        code: Source code of the function or class under test
+        extra_args: Additional command line arguments for pytest
+        cache_dir: Directory of the result cache, defaults to `.klaradvn` in the working directory
+        limits: Resource limits of the sandbox, defaults to `SandboxLimits()`
+
+    Returns:
+        Dictionary mapping every node ID to its 'outcome' (passed, failed,
+        skipped, error, timeout or not run), 'duration' in seconds, the growth of
+        the RSS of the pytest process during the test ('rss_delta') in bytes,
+        whether it is 'slow' and whether it was 'cached'
+    """
+
+    limits = limits or SandboxLimits()
+    cache_path = (cache_dir or Path.cwd() / CACHE_DIR) / CACHE_FILE
+    cache = _load_cache(cache_path)
+
+    hashes = {}
+    sources = {}
+    contexts = {}
+    for node_id in node_ids:
+        path, name = node_id.split('::', 1)
+        if path not in sources:
+            sources[path] = test_sources(Path(path))
+            contexts[path] = module_context(Path(path)) + _conftest_sources(Path(path))
+        hashes[node_id] = _hash(sources[path].get(name, ''), contexts[path], code, *extra_args)
+
+    results = {n: {**cache[h], 'cached': True} for n, h in hashes.items() if h in cache}
+    pending = [n for n in node_ids if n not in results]
+    if pending:
+        for node_id, result in _run_pytest(pending, extra_args, limits).items():
+            result['slow'] = result['outcome'] == 'timeout' or result['duration'] > limits.test_budget
+            results[node_id] = {**result, 'cached': False}
+            if result['outcome'] != 'not run':
+                cache[hashes[node_id]] = result
+        _save_cache(cache_path, cache)
+
+    passed = sum(r['outcome'] == 'passed' for r in results.values())
+    cached = sum(r['cached'] for r in results.values())
+    print(f"{passed}/{len(results)} tests passed ({cached} results from cache)")
+    for node_id, result in results.items():
+        if result['slow']:
+            print(f"  slow: {node_id} ({result['outcome']}, {result['duration']:.2f}s, +{result['rss_delta'] / 2 ** 20:.0f} MiB)")
+    return results
+
+
+def apply_test_budget(results: Dict[str, Dict[str, Any]], policy: str = 'reject') -> List[str]:
+    """
+    Keep slow tests out of the test modules.
+
+    Args:
+        results: Results of `run_tests`
+        policy: 'reject' removes slow tests from their module, 'mark' marks them
+            with `@pytest.mark.slow` so they can be deselected with `-m "not slow"`
+
+    Returns:
+        Node IDs of the removed or marked tests
+    """
+
+    if policy not in ('reject', 'mark'):
+        raise ValueError(f"Unknown policy for slow tests: {policy}")
+    slow: Dict[str, List[str]] = {}
+    for node_id, result in results.items():
+        if result['slow']:
+            path, name = node_id.split('::', 1)
+            slow.setdefault(path, []).append(name)
+    for path, names in slow.items():
+        if policy == 'reject':
+            remove_tests(Path(path), names)
+        else:
+            mark_tests(Path(path), names)
+    handled = [f"{path}::{name}" for path, names in slow.items() for name in names]
+    if handled:
+        print(f"{'Removed' if policy == 'reject' else 'Marked'} {len(handled)} slow tests")
+    return handled
+
+
+def verify_tests(node_ids: List[str], code: str, extra_args: Sequence[str] = (), limits: Optional[SandboxLimits] = None, on_slow: str = 'reject', run_id: Optional[int] = None, history_path: Optional[Path] = None) -> List[str]:
+    """
+    Run newly generated tests in the sandbox, record their results and keep slow tests out of the test modules.
+
+    Args:
+        node_ids: pytest node IDs of the generated tests
+        code: Source code of the function or class under test
+        extra_args: Additional command line arguments for pytest
+        limits: Resource limits of the sandbox, defaults to `SandboxLimits()`
+        on_slow: Policy for slow tests, see `apply_test_budget`
+        run_id: ID of the generation run in the history, the results are not
+            recorded without it
+        history_path: SQLite database the run was recorded in, see `record_run`
+
+    Returns:
+        The node IDs of the tests that remain in the test modules
+    """
+
+    results = run_tests(node_ids, code, extra_args, limits=limits)
+    if run_id is not None:
+        record_test_results(run_id, results, history_path)
+    handled = apply_test_budget(results, on_slow)
+    return [n for n in node_ids if on_slow == 'mark' or n not in handled]
+
+
+def _hash(*parts: str) -> str:
+    return hashlib.sha256("\0".join(parts).encode('utf-8')).hexdigest()
+
+
+def _conftest_sources(test_file: Path) -> str:
+    """Return the sources of the `conftest.py` files that apply to a test module."""
+
+    sources = []
+    for directory in test_file.resolve().parents:
+        conftest = directory / 'conftest.py'
+        if conftest.is_file():
+            sources += [str(conftest), conftest.read_text(encoding='utf-8')]
+    return "\0".join(sources)
+
+
+def _run_pytest(node_ids: List[str], extra_args: Sequence[str], limits: SandboxLimits) -> Dict[str, Dict[str, Any]]:
+    """Run the tests in a sandboxed pytest process and collect the reports of its plugin."""
+
+    fd, report_path = tempfile.mkstemp(suffix='.jsonl')
+    os.close(fd)
+    # The tests run in a temporary directory, keep the project importable
+    env = {**os.environ, REPORT_ENV: report_path,
+           'PYTHONPATH': os.pathsep.join(filter(None, [os.getcwd(), os.environ.get('PYTHONPATH')]))}
+    args = [sys.executable, '-m', 'pytest', *node_ids, '-p', 'klaradvn.sandbox_plugin', '-p', 'no:cacheprovider', *extra_args]
+    try:
+        with tempfile.TemporaryDirectory(prefix='klaradvn-') as cwd:
+            run = run_sandboxed(args, limits, cwd, env)
+        with open(report_path, encoding='utf-8') as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    finally:
+        os.unlink(report_path)
+
+    results = {}
+    for node_id in node_ids:
+        path, name = node_id.split('::', 1)
+        matches = [r for r in records if r.get('path') and _same_file(r['path'], path) and _top_level_name(r['nodeid']) == name]
+        reports = [r for r in matches if r['event'] == 'report']
+        results[node_id] = {
+            'outcome': _outcome(matches, run['timed_out']),
+            'duration': sum(r['duration'] for r in reports),
+            'rss_delta': max([r['rss_delta'] for r in reports], default=0),
+        }
+    return results
+
+
+def _same_file(a: str, b: str) -> bool:
+    return os.path.realpath(a) == os.path.realpath(b)
+
+
+def _top_level_name(nodeid: str) -> str:
+    """Return the name of the top-level test function or class of a pytest node ID."""
+
+    return nodeid.split('::')[1].split('[')[0]
+
+
+def _outcome(records: List[Dict[str, Any]], timed_out: bool) -> str:
+    reports = [r for r in records if r['event'] == 'report']
+    started = {r['nodeid'] for r in records if r['event'] == 'start'}
+    finished = {r['nodeid'] for r in reports if r['when'] == 'teardown'}
+    if started - finished:
+        return 'timeout' if timed_out else 'error'
+    if not reports:
+        return 'not run' if timed_out else 'error'
+    if any(r['outcome'] == 'failed' for r in reports):
+        return 'failed'
+    if all(r['outcome'] == 'skipped' for r in reports if r['when'] != 'teardown'):
+        return 'skipped'
+    return 'passed'
+
+
+def _load_cache(cache_path: Path) -> Dict[str, Dict[str, Any]]:
+    try:
+        return json.loads(cache_path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache_path: Path, cache: Dict[str, Dict[str, Any]]) -> None:
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    cache_path.write_text(json.dumps(cache, indent=2), encoding='utf-8')
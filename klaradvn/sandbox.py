@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+import signal
+import subprocess
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows, only the wall-clock timeout applies
+    resource = None
+
+
+@dataclass
+class SandboxLimits:
+    """
+    Resource limits for running generated tests.
+
+    `timeout` bounds the wall-clock time of the complete run, `test_budget` is
+    the duration in seconds above which a single test counts as slow. Limits
+    set to None are not applied. Note that the process limit counts all
+    processes of the user, not only those of the sandbox.
+    """
+
+    timeout: float = 120.0
+    memory_mb: Optional[int] = 2048
+    cpu_seconds: Optional[int] = 120
+    max_processes: Optional[int] = None
+    test_budget: float = 5.0
+
+
+def run_sandboxed(args: List[str], limits: Optional[SandboxLimits] = None, cwd: Optional[str] = None, env: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """
+    Run a command with resource limits in its own process group.
+
+    The limits are applied with `resource.setrlimit` in the child process. When
+    the wall-clock timeout expires the complete process group is killed, so
+    processes started by the tests cannot outlive the run either.
+
+    Args:
+        args: Command and its arguments
+        limits: Resource limits, defaults to `SandboxLimits()`
+        cwd: Working directory of the command
+        env: Environment of the command
+
+    Returns:
+        Dictionary with the 'returncode' (None on a timeout), whether the run
+        'timed_out', its 'duration' in seconds and the 'peak_rss' in bytes
+    """
+
+    limits = limits or SandboxLimits()
+    if resource:
+        # Apply the limits in a launcher that execs the command; unlike preexec_fn
+        # this is safe when the calling process runs threads
+        args = [sys.executable, '-m', 'klaradvn.sandbox', str(limits.memory_mb), str(limits.cpu_seconds), str(limits.max_processes), '--', *args]
+    start = time.monotonic()
+    process = subprocess.Popen(args, cwd=cwd, env=env, start_new_session=True)
+    deadline = start + limits.timeout
+    peak_rss = 0
+    timed_out = False
+    while True:
+        if hasattr(os, 'wait4'):
+            pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                process.returncode = os.waitstatus_to_exitcode(status)
+                peak_rss = rss_bytes(usage.ru_maxrss)
+                break
+        elif process.poll() is not None:
+            break
+        if time.monotonic() > deadline:
+            timed_out = True
+            _kill_group(process)
+            break
+        time.sleep(0.01)
+    return {
+        'returncode': None if timed_out else process.returncode,
+        'timed_out': timed_out,
+        'duration': time.monotonic() - start,
+        'peak_rss': peak_rss,
+    }
+
+
+def rss_bytes(max_rss: int) -> int:
+    """Convert `ru_maxrss` to bytes, it is reported in kilobytes except on macOS."""
+
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _kill_group(process: subprocess.Popen) -> None:
+    if hasattr(os, 'killpg'):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    else:
+        process.kill()
+    process.wait()
+
+
+def _main(argv: List[str]) -> None:
+    """Launcher used by `run_sandboxed`: apply the limits and exec the command."""
+
+    memory_mb, cpu_seconds, max_processes, _, *args = argv
+    limits = {
+        resource.RLIMIT_AS: None if memory_mb == 'None' else int(memory_mb) * 1024 * 1024,
+        resource.RLIMIT_CPU: None if cpu_seconds == 'None' else int(cpu_seconds),
+        resource.RLIMIT_NPROC: None if max_processes == 'None' else int(max_processes),
+    }
+    for limit, value in limits.items():
+        if value is not None:
+            resource.setrlimit(limit, (value, value))
+    os.execvp(args[0], args)
+
+
+if __name__ == '__main__':
+    _main(sys.argv[1:])
@@ -0,0 +1,63 @@
+"""
+pytest plugin that reports the outcome, duration and RSS growth of every test.
+
+The sandboxed runner loads it with `-p klaradvn.sandbox_plugin`. Reports are
+appended as JSON lines to the file in `KLARADVN_SANDBOX_REPORT` as soon as a
+test finishes, so the results survive when the run is killed.
+"""
+import os
+import json
+
+from klaradvn.sandbox import resource, rss_bytes
+
+REPORT_ENV = 'KLARADVN_SANDBOX_REPORT'
+
+_paths = {}
+_start_rss = {}
+
+
+def _rss() -> int:
+    """Return the current RSS in bytes, or the peak RSS where /proc is not available."""
+
+    try:
+        with open('/proc/self/statm', encoding='ascii') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        if resource is None:
+            return 0
+        return rss_bytes(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def _write(record: dict) -> None:
+    path = os.environ.get(REPORT_ENV)
+    if path:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+
+
+def pytest_collection_modifyitems(items):
+    for item in items:
+        _paths[item.nodeid] = str(item.path)
+
+
+def pytest_collectreport(report):
+    if report.failed:
+        _write({'event': 'collect_error', 'nodeid': report.nodeid})
+
+
+def pytest_runtest_logstart(nodeid, location):
+    _start_rss[nodeid] = _rss()
+    _write({'event': 'start', 'nodeid': nodeid, 'path': _paths.get(nodeid)})
+
+
+def pytest_runtest_logreport(report):
+    _write({
+        'event': 'report',
+        'nodeid': report.nodeid,
+        'path': _paths.get(report.nodeid),
+        'when': report.when,
+        'outcome': report.outcome,
+        'duration': report.duration,
+        # Memory the test still holds, the RSS of the process is shared by all tests of the run
+        'rss_delta': max(0, _rss() - _start_rss.get(report.nodeid, 0)),
+    })
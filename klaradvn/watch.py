@@ -0,0 +1,213 @@
+import os
+import sys
+import time
+import queue
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+
+from klaradvn.extract import directories, is_source_file, source_files, extract_symbols
+from klaradvn.generate import generate_tests
+from klaradvn.runner import run_tests
+
+# inotify flags, see inotify(7)
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def watch_tree(path: Path, debounce: float = 0.5, poll: bool = False, poll_interval: float = 1.0) -> None:
+    """
+    Watch a source tree and regenerate the tests of every edited function or class.
+
+    Bursts of saves are coalesced until the tree has been quiet for `debounce`
+    seconds. Only symbols whose source changed are queued for generation, and
+    a queued or running generation is cancelled when its symbol changes again.
+    The regenerations are not recorded in the run history.
+
+    Args:
+        path: Root of the source tree to watch
+        debounce: Quiet period in seconds before changes are processed
+        poll: Use polling instead of inotify
+        poll_interval: Interval in seconds between two scans when polling
+    """
+
+    path = Path(path).resolve()
+    watcher = _PollingWatcher(path, poll_interval) if poll or not _Inotify.available() else _Inotify(path)
+    snapshot = {f: _symbol_hashes(f) for f in source_files(path)}
+    jobs = queue.Queue()
+    in_flight: Dict[Tuple[Path, str], threading.Event] = {}
+    lock = threading.Lock()
+    threading.Thread(target=_worker, args=(jobs, in_flight, lock), name="klaradvn-watch", daemon=True).start()
+
+    print(f"Klara is watching {path} using {watcher.name} (press Ctrl-C to stop)")
+    try:
+        while True:
+            changed = watcher.wait(None)
+            # Coalesce the burst of saves until the tree has been quiet for a while
+            while more := watcher.wait(debounce):
+                changed |= more
+            for file_path in sorted(f for f in changed if is_source_file(f, path)):
+                hashes = _symbol_hashes(file_path) if file_path.exists() else {}
+                previous = snapshot.get(file_path, {})
+                snapshot[file_path] = hashes
+                for name, (digest, symbol) in hashes.items():
+                    if name in previous and previous[name][0] == digest:
+                        continue
+                    with lock:
+                        if event := in_flight.get((file_path, name)):
+                            event.set()
+                        event = in_flight[(file_path, name)] = threading.Event()
+                    print(f"{name} in {file_path} changed, queueing test generation")
+                    jobs.put((file_path, name, symbol['source_code'], event))
+    except KeyboardInterrupt:
+        with lock:
+            for event in in_flight.values():
+                event.set()
+        print("\nKlara stopped watching")
+    finally:
+        watcher.close()
+
+
+def _worker(jobs: queue.Queue, in_flight: Dict[Tuple[Path, str], threading.Event], lock: threading.Lock) -> None:
+    """
+    Generate and run the tests of queued symbols, skipping superseded jobs.
+
+    A failing job is reported and does not stop the worker. Finished jobs are
+    removed from `in_flight` unless their symbol was queued again meanwhile.
+    """
+
+    while True:
+        file_path, name, code, cancel_event = jobs.get()
+        try:
+            if cancel_event.is_set():
+                continue
+            report = {}
+            success, _ = generate_tests(file_path, code, name, report=report, cancel_event=cancel_event)
+            if success and not cancel_event.is_set():
+                run_tests(report['node_ids'], code)
+        except Exception as e:
+            print(f"Generating the tests of {name} in {file_path} failed: {e!r}")
+        finally:
+            with lock:
+                if in_flight.get((file_path, name)) is cancel_event:
+                    del in_flight[(file_path, name)]
+            jobs.task_done()
+
+
+def _symbol_hashes(file_path: Path) -> Dict[str, Tuple[str, dict]]:
+    try:
+        return {name: (symbol['hash'], symbol) for name, symbol in extract_symbols(file_path).items()}
+    except (OSError, UnicodeDecodeError):
+        return {}
+
+
+class _PollingWatcher:
+    """Detect changed Python files by comparing modification times."""
+
+    name = 'polling'
+
+    def __init__(self, root: Path, interval: float):
+        self.root = root
+        self.interval = interval
+        self.mtimes = self._scan()
+
+    def _scan(self) -> Dict[Path, int]:
+        mtimes = {}
+        for dir_path in directories(self.root):
+            for file_path in dir_path.glob('*.py'):
+                try:
+                    mtimes[file_path] = file_path.stat().st_mtime_ns
+                except OSError:
+                    continue
+        return mtimes
+
+    def wait(self, timeout: Optional[float]) -> Set[Path]:
+        """Wait up to `timeout` seconds (forever if None) for changed files."""
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            time.sleep(self.interval if deadline is None else max(0.0, min(self.interval, deadline - time.monotonic())))
+            mtimes = self._scan()
+            changed = {f for f in mtimes.keys() | self.mtimes.keys() if mtimes.get(f) != self.mtimes.get(f)}
+            self.mtimes = mtimes
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def close(self) -> None:
+        pass
+
+
+class _Inotify:
+    """Minimal ctypes binding of the Linux inotify API."""
+
+    name = 'inotify'
+
+    _libc = None
+
+    @classmethod
+    def available(cls) -> bool:
+        if not sys.platform.startswith('linux'):
+            return False
+        if cls._libc is None:
+            try:
+                cls._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+                cls._libc.inotify_init1
+            except (OSError, AttributeError):
+                return False
+        return True
+
+    def __init__(self, root: Path):
+        self.available()
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories: Dict[int, Path] = {}
+        for dir_path in directories(root):
+            self._add_watch(dir_path)
+
+    def _add_watch(self, dir_path: Path) -> None:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(dir_path), WATCH_MASK)
+        if wd >= 0:
+            self.directories[wd] = dir_path
+
+    def wait(self, timeout: Optional[float]) -> Set[Path]:
+        """Wait up to `timeout` seconds (forever if None) for changed files."""
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+            name = buffer[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+            if wd not in self.directories or not name:
+                continue
+            path = self.directories[wd] / os.fsdecode(name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add_watch(path)
+            elif path.suffix == '.py':
+                changed.add(path)
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
@@ -0,0 +1,402 @@
+import os
+import re
+import ast
+import tempfile
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from klaradvn.dedup import normalized_hash
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Comment above every test, fixture and helper written by Klara, only these are ever replaced
+GENERATED_MARKER = "# Generated by klaradvn"
+
+
+def merge_tests(output_file: Path, test_code: str, symbol: str, replace: bool = True) -> List[str]:
+    """
+    Merge generated test code into a test module at the AST level.
+
+    Imports are deduplicated per imported name, existing tests that Klara
+    generated for `symbol` (see `GENERATED_MARKER`) are replaced by the new
+    ones and tests that only differ from another test in names or literals are
+    dropped (see `normalized_hash`). Generated fixtures and helpers replace
+    the generated ones of the same name; when they clash with one written by
+    hand, the generated one is renamed in the new code instead. Tests, fixtures
+    and helpers written by hand and the comments of the module are kept. The
+    module is rewritten atomically while holding a
+    lock on it, so concurrent runs for the same module cannot interleave their
+    writes.
+
+    Args:
+        output_file: Path to the test module, created if it does not exist
+        test_code: Generated test code
+        symbol: Name of the function or class the tests were generated for
+        replace: Replace the generated tests of `symbol`, otherwise the new tests are added
+
+    Returns:
+        Names of the tests (functions or classes) added by this generation
+
+    Raises:
+        SyntaxError: If the generated or the existing test code does not parse
+        ValueError: If the generated code contains no tests, the module is left untouched
+    """
+
+    new = _Module(test_code)
+    if not new.tests:
+        raise ValueError("The generated code contains no tests")
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    with _file_lock(output_file):
+        existing = _Module(output_file.read_text(encoding='utf-8') if output_file.exists() else "")
+
+        # Fixtures and helpers written by hand are never replaced, rename the generated ones instead
+        handwritten = {statement_name(s): s for s in existing.others if not existing.generated(s)}
+        renames = {}
+        taken_names = set(handwritten) | set(re.findall(r'\w+', test_code + "\n".join(existing.segment(n) for n in existing.imports)))
+        for statement in new.others:
+            name = statement_name(statement)
+            if name in handwritten and ast.dump(statement) != ast.dump(handwritten[name]):
+                renames[name] = unique_name(name, taken_names)
+                taken_names.add(renames[name])
+        if renames:
+            new = _Module(rename_symbols(test_code, renames))
+
+        # Generated tests of the symbol that are not regenerated are stale
+        kept_tests = [t for t in existing.tests if not (replace and existing.generated(t) and _uses_name(t, symbol))]
+        taken = {t.name for t in kept_tests}
+        seen = {normalized_hash(t) for t in kept_tests}
+
+        added = []
+        new_tests = []
+        for test in new.tests:
+            key = normalized_hash(test)
+            if key in seen:
+                continue
+            seen.add(key)
+            name = unique_name(test.name, taken)
+            taken.add(name)
+            new_tests.append((test, name))
+            added.append(name)
+
+        # Helpers and fixtures of the generation replace generated ones with the same name
+        new_names = {statement_name(s) for s in new.others} - {None}
+        kept_others = [s for s in existing.others if not (existing.generated(s) and statement_name(s) in new_names)]
+        kept_dumps = {ast.dump(s) for s in kept_others}
+        new_others = [s for s in new.others if ast.dump(s) not in kept_dumps]
+
+        blocks = ["\n".join(b for b in (existing.header, _render_imports(existing, new)) if b)]
+        blocks += [existing.segment(s) for s in kept_others]
+        blocks += [existing.segment(t) for t in kept_tests]
+        blocks += [f"{GENERATED_MARKER}\n{new.segment(s)}" for s in new_others]
+        blocks += [f"{GENERATED_MARKER}\n{_rename(new.segment(t), t, name)}" for t, name in new_tests]
+        blocks += [existing.footer]
+        _atomic_write(output_file, "\n\n\n".join(b for b in blocks if b) + "\n")
+    return added
+
+
+class _Module:
+    """
+    Parsed test module split into imports, tests and other statements.
+
+    The comments between two statements belong to the second one, the comments
+    before the first statement and after the last one are the `header` and the
+    `footer` of the module.
+    """
+
+    def __init__(self, source: str):
+        self.lines = source.splitlines()
+        self.imports = []
+        self.tests = []
+        self.others = []
+        self._comments = {}
+        body = ast.parse(source).body
+        previous_end = _first_line(body[0]) - 1 if body else len(self.lines)
+        self.header = "\n".join(self.lines[:previous_end]).strip()
+        for node in body:
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                self.imports.append(node)
+            elif is_test(node):
+                self.tests.append(node)
+            else:
+                self.others.append(node)
+            comments = self.lines[previous_end:_first_line(node) - 1]
+            while comments and not comments[0].strip():
+                comments.pop(0)
+            self._comments[node] = comments
+            previous_end = node.end_lineno
+        self.footer = "\n".join(self.lines[previous_end:]).strip() if body else ""
+
+    def start(self, node: ast.stmt) -> int:
+        """Return the first line of a top-level statement, including its decorators and comments."""
+
+        return _first_line(node) - len(self._comments[node])
+
+    def segment(self, node: ast.stmt, comments: bool = True) -> str:
+        """Return the source of a top-level statement, including its decorators and optionally its comments."""
+
+        start = self.start(node) if comments else _first_line(node)
+        return "\n".join(self.lines[start - 1:node.end_lineno])
+
+    def generated(self, node: ast.stmt) -> bool:
+        """Check whether a top-level statement was written by Klara."""
+
+        return any(line.strip() == GENERATED_MARKER for line in self._comments[node])
+
+
+def _first_line(node: ast.stmt) -> int:
+    return min([node.lineno] + [d.lineno for d in getattr(node, 'decorator_list', [])])
+
+
+def _preamble_end(body: List[ast.stmt]) -> int:
+    # The module docstring and the `from __future__` imports must stay before any other statement
+    end = 0
+    for index, node in enumerate(body):
+        if index == 0 and isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str):
+            end = node.end_lineno
+        elif isinstance(node, ast.ImportFrom) and node.module == '__future__':
+            end = node.end_lineno
+        else:
+            break
+    return end
+
+
+def is_test(node: ast.stmt) -> bool:
+    """Check whether a top-level statement is a test function or test class that pytest collects."""
+
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        return node.name.startswith('test')
+    return isinstance(node, ast.ClassDef) and node.name.startswith('Test')
+
+
+def _uses_name(node: ast.AST, name: str) -> bool:
+    # A qualified name like `Class.method` is used when the class is referenced and the method accessed
+    first, *attributes = name.split('.')
+    nodes = list(ast.walk(node))
+    if not any(isinstance(n, ast.Name) and n.id == first for n in nodes):
+        return False
+    return set(attributes) <= {n.attr for n in nodes if isinstance(n, ast.Attribute)}
+
+
+class _Renamer(ast.NodeTransformer):
+    """Rename classes, functions, parameters and variables, leaving strings and attributes alone."""
+
+    def __init__(self, renames: Dict[str, str]):
+        self.renames = renames
+
+    def visit_FunctionDef(self, node: ast.FunctionDef) -> ast.AST:
+        node.name = self.renames.get(node.name, node.name)
+        return self.generic_visit(node)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+    visit_ClassDef = visit_FunctionDef
+
+    def visit_arg(self, node: ast.arg) -> ast.AST:
+        node.arg = self.renames.get(node.arg, node.arg)
+        return node
+
+    def visit_Name(self, node: ast.Name) -> ast.AST:
+        node.id = self.renames.get(node.id, node.id)
+        return node
+
+
+def rename_symbols(source: str, renames: Dict[str, str]) -> str:
+    """
+    Rename classes, functions, parameters and variables in Python code.
+
+    Only definitions and references are renamed, not string literals, dictionary
+    keys or attributes. The code is unparsed, so its comments are lost.
+
+    Args:
+        source: Python source code
+        renames: Mapping of the old to the new names
+
+    Returns:
+        The source code with the names replaced
+    """
+
+    return ast.unparse(_Renamer(renames).visit(ast.parse(source))) + "\n"
+
+
+def unique_name(name: str, taken: set) -> str:
+    """Suffix a name with the first free number when it is already taken."""
+
+    candidate, i = name, 2
+    while candidate in taken:
+        candidate, i = f"{name}_{i}", i + 1
+    return candidate
+
+
+def _rename(source: str, node: ast.stmt, name: str) -> str:
+    if name == node.name:
+        return source
+    keyword = 'class' if isinstance(node, ast.ClassDef) else 'def'
+    return source.replace(f"{keyword} {node.name}", f"{keyword} {name}", 1)
+
+
+def statement_name(node: ast.stmt) -> Optional[str]:
+    """Return the name a function, class or simple assignment defines, None for other statements."""
+
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return node.name
+    if isinstance(node, (ast.Assign, ast.AnnAssign)):
+        targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+        if len(targets) == 1 and isinstance(targets[0], ast.Name):
+            return targets[0].id
+    return None
+
+
+def _render_imports(existing: _Module, new: _Module) -> str:
+    """Render the import statements of both modules, dropping every name that is already imported."""
+
+    seen = set()
+    rendered = []
+    for module, node in [(existing, n) for n in existing.imports] + [(new, n) for n in new.imports]:
+        if isinstance(node, ast.Import):
+            keys: List[Tuple] = [('import', a.name, a.asname) for a in node.names]
+        else:
+            keys = [('from', node.module, node.level, a.name, a.asname) for a in node.names]
+        fresh = [a for a, k in zip(node.names, keys) if k not in seen]
+        seen.update(keys)
+        if not fresh:
+            continue
+        if len(fresh) == len(node.names):
+            rendered.append(module.segment(node))
+        else:
+            node = type(node)(**{**node.__dict__, 'names': fresh})
+            rendered.append(ast.unparse(node))
+    return "\n".join(rendered)
+
+
+@contextmanager
+def _file_lock(path: Path) -> Iterator[None]:
+    """Hold an exclusive lock on a hidden sidecar file of `path`."""
+
+    lock_path = path.parent / f".{path.name}.lock"
+    with open(lock_path, 'a') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _atomic_write(path: Path, content: str) -> None:
+    """Write the file through a temporary file and an atomic rename."""
+
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, path.stat().st_mode if path.exists() else 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def symbol_tests(test_file: Path, symbol: str) -> List[str]:
+    """
+    Return the names of the top-level tests in a test module that use a symbol.
+
+    Args:
+        test_file: Path to the test module
+        symbol: Name of the function or class under test
+
+    Returns:
+        Names of the test functions and classes, empty if the module does not exist
+    """
+
+    if not test_file.exists():
+        return []
+    module = _Module(test_file.read_text(encoding='utf-8'))
+    return [test.name for test in module.tests if _uses_name(test, symbol)]
+
+
+def remove_tests(test_file: Path, names: List[str]) -> None:
+    """
+    Remove top-level tests from a test module.
+
+    Args:
+        test_file: Path to the test module
+        names: Names of the test functions or classes to remove
+    """
+
+    with _file_lock(test_file):
+        source = test_file.read_text(encoding='utf-8')
+        module = _Module(source)
+        lines = list(module.lines)
+        for test in sorted((t for t in module.tests if t.name in names), key=lambda t: t.lineno, reverse=True):
+            start = module.start(test)
+            del lines[start - 1:test.end_lineno]
+            # Keep the blank lines before the test, drop the ones after it
+            while start - 1 < len(lines) and not lines[start - 1].strip() and start > 1 and not lines[start - 2].strip():
+                del lines[start - 1]
+        _atomic_write(test_file, "\n".join(lines).rstrip() + "\n")
+
+
+def mark_tests(test_file: Path, names: List[str], marker: str = 'slow') -> None:
+    """
+    Add a `pytest.mark` marker to top-level tests of a test module.
+
+    Args:
+        test_file: Path to the test module
+        names: Names of the test functions or classes to mark
+        marker: Name of the marker
+    """
+
+    decorator = f"pytest.mark.{marker}"
+    with _file_lock(test_file):
+        source = test_file.read_text(encoding='utf-8')
+        module = _Module(source)
+        lines = list(module.lines)
+        for test in sorted((t for t in module.tests if t.name in names), key=lambda t: t.lineno, reverse=True):
+            if any(ast.unparse(d) == decorator for d in test.decorator_list):
+                continue
+            lines.insert(_first_line(test) - 1, " " * test.col_offset + f"@{decorator}")
+        if not any(isinstance(n, ast.Import) and any(a.name == 'pytest' and a.asname is None for a in n.names) for n in module.imports):
+            lines.insert(_preamble_end(ast.parse(source).body), "import pytest")
+        _atomic_write(test_file, "\n".join(lines).rstrip() + "\n")
+
+
+def test_sources(test_file: Path) -> Dict[str, str]:
+    """
+    Return the source of every top-level test in a test module.
+
+    Args:
+        test_file: Path to the test module
+
+    Returns:
+        Dictionary mapping the test function or class names to their source code
+    """
+
+    module = _Module(test_file.read_text(encoding='utf-8'))
+    return {test.name: module.segment(test, comments=False) for test in module.tests}
+
+
+def module_context(test_file: Path) -> str:
+    """
+    Return the source of the statements of a test module that are not tests.
+
+    Args:
+        test_file: Path to the test module
+
+    Returns:
+        The imports, fixtures, helpers and other module-level statements, in module order
+    """
+
+    module = _Module(test_file.read_text(encoding='utf-8'))
+    nodes = sorted(module.imports + module.others, key=lambda node: node.lineno)
+    return "\n".join(module.segment(node, comments=False) for node in nodes)
@@ -1,8 +1,20 @@
+import socket
 from pathlib import Path
 
+import pytest
+
 def pytest_sessionstart(session):
     """Removes all previously automatically created test files"""
     test_folder_test_package =  Path(__file__).parent / 'test-package' / 'tests'
     for f in test_folder_test_package.rglob('*.py'):
         if f.name != "__init__.py":
-            f.unlink()
\ No newline at end of file
+            f.unlink()
+
+@pytest.fixture
+def silent_server():
+    """Server that accepts connections but never answers, like a stalled daemon."""
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen()
+    yield f"http://127.0.0.1:{server.getsockname()[1]}"
+    server.close()
@@ -0,0 +1,54 @@
+import socket
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from klaradvn.aio import extract_class_async, extract_function_code_async, stream_test_code, gather_tests_async
+from klaradvn.client import ClientConfig, GenerationTimeout
+from klaradvn.extract import extract_function_code
+from klaradvn.history import load_runs
+
+PATH_PACKAGE = Path(__file__).parent / 'test-package'
+
+async def consume(stream):
+    return [token async for token in stream]
+
+def test_extract_async():
+    async def extract():
+        return await asyncio.gather(
+            extract_function_code_async(str(PATH_PACKAGE), 'another_function'),
+            extract_class_async(PATH_PACKAGE, 'CoolNewList'),
+        )
+    (code, path), class_info = asyncio.run(extract())
+    assert (code, path) == extract_function_code(str(PATH_PACKAGE), 'another_function')
+    assert class_info['source_code'].startswith('@dataclass')
+
+def test_stream_first_token_timeout(silent_server):
+    config = ClientConfig(host=silent_server, first_token_timeout=0.3, max_retries=0)
+    with pytest.raises(GenerationTimeout):
+        asyncio.run(consume(stream_test_code("def f(): pass", client_config=config)))
+
+def test_stream_cancel(silent_server):
+    config = ClientConfig(host=silent_server, first_token_timeout=30, max_retries=0)
+
+    async def cancel():
+        task = asyncio.create_task(consume(stream_test_code("def f(): pass", client_config=config)))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        await task
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(cancel())
+
+def test_gather_tests_async_network_errors(tmp_path):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    config = ClientConfig(host=f"http://127.0.0.1:{port}", max_retries=1, backoff_base=0.0)
+    code_file = PATH_PACKAGE / 'package_one' / 'lorem_ipsum.py'
+    targets = [(code_file, "def f(): pass", 'f')] * 3
+    history_path = tmp_path / 'history.sqlite'
+    results = asyncio.run(gather_tests_async(targets, concurrency=2, client_config=config, history_path=history_path))
+    assert results == [(False, PATH_PACKAGE / 'tests' / 'test_lorem_ipsum.py')] * 3
+    assert [run['validation'] for run in load_runs(history_path)] == ['no response'] * 3
@@ -0,0 +1,29 @@
+from pathlib import Path
+
+from klaradvn.budget import measure_complexity, generation_options, MIN_TOKENS, MAX_TOKENS, STOP_SEQUENCES
+from klaradvn.extract import extract_function_code, extract_class
+
+PATH_PACKAGE = Path(__file__).parent / 'test-package'
+
+def test_measure_complexity_function():
+    code, _ = extract_function_code(str(PATH_PACKAGE), 'another_function')
+    assert measure_complexity(code) == {'branches': 0, 'parameters': 2, 'methods': 1}
+
+def test_measure_complexity_class():
+    result = extract_class(PATH_PACKAGE, 'CoolNewList')
+    assert measure_complexity(result['source_code']) == {'branches': 1, 'parameters': 2, 'methods': 3}
+
+def test_generation_options_scale_with_complexity():
+    small, _ = extract_function_code(str(PATH_PACKAGE), 'another_function')
+    large = extract_class(PATH_PACKAGE, 'CoolNewList')['source_code']
+    assert generation_options(small)['num_predict'] < generation_options(large)['num_predict']
+    assert generation_options(small)['stop'] == generation_options(small, structured=True)['stop'] == STOP_SEQUENCES
+
+def test_measure_complexity_with_is_no_branch():
+    code = "def read(path):\n    with open(path) as f:\n        return f.read() or None\n"
+    assert measure_complexity(code) == {'branches': 1, 'parameters': 1, 'methods': 1}
+
+def test_generation_options_bounds():
+    assert generation_options("x = 1")['num_predict'] >= MIN_TOKENS
+    huge = "\n".join(f"def f{i}(a, b):\n    if a:\n        return b" for i in range(100))
+    assert generation_options(huge)['num_predict'] == MAX_TOKENS
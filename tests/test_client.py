@@ -0,0 +1,33 @@
+import socket
+import threading
+
+import httpx
+import pytest
+
+from klaradvn.client import ClientConfig, GenerationCancelled, GenerationTimeout, backoff_delay, stream_generate
+
+def test_backoff_delay_bounds():
+    config = ClientConfig(backoff_base=1.0, backoff_max=5.0)
+    for attempt in range(10):
+        assert 0 <= backoff_delay(attempt, config) <= min(5.0, 2 ** attempt)
+
+def test_first_token_timeout(silent_server):
+    config = ClientConfig(host=silent_server, first_token_timeout=0.3, max_retries=0)
+    with pytest.raises(GenerationTimeout):
+        list(stream_generate("prompt", config))
+
+def test_retries_connection_error(capsys):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    config = ClientConfig(host=f"http://127.0.0.1:{port}", max_retries=2, backoff_base=0.0)
+    with pytest.raises(httpx.ConnectError):
+        list(stream_generate("prompt", config))
+    assert "retrying" in capsys.readouterr().out
+
+def test_cancel(silent_server):
+    config = ClientConfig(host=silent_server, first_token_timeout=30, max_retries=0)
+    cancel_event = threading.Event()
+    threading.Timer(0.2, cancel_event.set).start()
+    with pytest.raises(GenerationCancelled):
+        list(stream_generate("prompt", config, cancel_event))
@@ -0,0 +1,45 @@
+from klaradvn.coverage import measure_coverage, annotate_lines
+from klaradvn.sandbox import SandboxLimits
+
+MODULE = """def classify(n):
+    if n > 0:
+        return 'positive'
+    elif n < 0:
+        return 'negative'
+    return 'zero'
+
+
+def unrelated():
+    return 1
+"""
+
+TESTS = """from module import classify
+
+def test_positive():
+    assert classify(1) == 'positive'
+
+def test_zero():
+    assert classify(0) == 'zero'
+"""
+
+def test_measure_coverage(tmp_path):
+    (tmp_path / 'module.py').write_text(MODULE)
+    (tmp_path / 'test_module.py').write_text(TESTS)
+    node_ids = [f"{tmp_path / 'test_module.py'}::test_positive", f"{tmp_path / 'test_module.py'}::test_zero"]
+    result = measure_coverage(node_ids, tmp_path / 'module.py', 1, 6, ['--rootdir', str(tmp_path), '-p', 'no:cacheprovider'])
+    assert result['lines'] == [1, 2, 3, 4, 5, 6]
+    assert result['missing_lines'] == [5]
+    assert result['missing_branches'] == [4]
+    assert result['branch_rate'] == 0.75
+
+def test_measure_coverage_timeout(tmp_path):
+    (tmp_path / 'module.py').write_text(MODULE)
+    (tmp_path / 'test_module.py').write_text(TESTS + "\ndef test_hanging():\n    while True:\n        classify(1)\n")
+    node_ids = [f"{tmp_path / 'test_module.py'}::test_hanging"]
+    result = measure_coverage(node_ids, tmp_path / 'module.py', 1, 6, ['--rootdir', str(tmp_path), '-p', 'no:cacheprovider'], SandboxLimits(timeout=2))
+    assert result['timed_out']
+    assert result['line_rate'] == 0
+
+def test_annotate_lines():
+    code = "def f(n):\n    if n:\n        return 1\n    return 2"
+    assert annotate_lines(code, 10, [12]) == "def f(n):\n    if n:\n        return 1  # NOT COVERED\n    return 2"
@@ -0,0 +1,31 @@
+import ast
+
+from klaradvn.dedup import normalized_hash, deduplicate
+
+def parse(code):
+    return ast.parse(code).body[0]
+
+def test_normalized_hash_ignores_names_and_docstrings():
+    a = parse("def test_a():\n    '''Basic case'''\n    result = another_function(1, 2)\n    assert result == True, 'n2 > n1'")
+    b = parse("def test_b():\n    r = another_function(5, 10)\n    assert r == True, 'expected True'")
+    assert normalized_hash(a) == normalized_hash(b)
+
+def test_normalized_hash_keeps_meaningful_differences():
+    base = normalized_hash(parse("def test_a():\n    assert another_function(1, 2) == True"))
+    assert base != normalized_hash(parse("def test_a():\n    assert another_function(3, 3) == True"))
+    assert base != normalized_hash(parse("def test_a():\n    assert another_function(-1, 2) == True"))
+    assert base != normalized_hash(parse("def test_a():\n    assert another_function(1, 2) == False"))
+    assert base != normalized_hash(parse("def test_a():\n    assert lorem_ipsum(1, 2) == True"))
+
+def test_normalized_hash_fixtures():
+    a = parse("def test_add(empty_list):\n    empty_list.add_element(1)\n    assert empty_list.elements == [1]")
+    b = parse("def test_add_one(empty_list):\n    empty_list.add_element(7)\n    assert empty_list.elements == [7]")
+    c = parse("def test_add(full_list):\n    full_list.add_element(1)\n    assert full_list.elements == [1]")
+    assert normalized_hash(a) == normalized_hash(b)
+    # Parameters name fixtures, so tests using other fixtures are different
+    assert normalized_hash(a) != normalized_hash(c)
+
+def test_deduplicate():
+    tests = [parse(f"def test_{i}():\n    x = {n}\n    assert f(x)") for i, n in enumerate([1, 2, 0, -1, 3])]
+    seen = {normalized_hash(parse("def test_existing():\n    assert f(0)"))}
+    assert [t.name for t in deduplicate(tests, seen)] == ['test_0', 'test_2', 'test_3']
@@ -1,6 +1,10 @@
+import json
 from pathlib import Path
 
-from klaradvn.extract import extract_function_code, extract_class
+import pytest
+
+from klaradvn import extract
+from klaradvn.extract import AmbiguousSymbolError, SymbolIndex, extract_function_code, extract_class, extract_symbols
 
 PATH_PACKAGE = Path(__file__).parent / 'test-package'
 
@@ -60,4 +64,90 @@ def test_extract_class_custom():
         self.x += shift
     
     def get_coords(self) -> tuple[int, int]:
-        return self.x, self.y"""
\ No newline at end of file
+        return self.x, self.y"""
+
+def test_extract_symbols():
+    symbols = extract_symbols(PATH_PACKAGE / 'package_one' / 'amazing_class.py')
+    assert list(symbols) == ['CoolNewList', 'MyCustomObject']
+    assert symbols['CoolNewList']['kind'] == 'class'
+    assert symbols['CoolNewList']['source_code'].startswith('@dataclass\nclass CoolNewList:')
+    assert (symbols['CoolNewList']['lineno'], symbols['CoolNewList']['end_lineno']) == (3, 16)
+    another_function = extract_symbols(PATH_PACKAGE / 'package_one' / 'lorem_ipsum.py')['another_function']
+    assert another_function['kind'] == 'function'
+    assert another_function['source_code'] == extract_function_code(str(PATH_PACKAGE), 'another_function')[0]
+
+SHAPES = """import asyncio
+
+def area(shape):
+    return shape.area()
+
+class Square:
+    def __init__(self, side):
+        self.side = side
+
+    def area(self):
+        def squared(n):
+            return n * n
+        return squared(self.side)
+
+    async def fetch(self):
+        await asyncio.sleep(0)
+"""
+
+def write_shapes(root):
+    (root / 'geometry').mkdir()
+    (root / 'geometry' / '__init__.py').write_text("")
+    (root / 'geometry' / 'shapes.py').write_text(SHAPES)
+    (root / 'geometry' / 'circles.py').write_text("class Circle:\n    def area(self):\n        return 3\n")
+    (root / 'tests').mkdir()
+    (root / 'tests' / 'test_shapes.py').write_text("def area():\n    pass\n")
+
+def test_symbol_index_qualified_names(tmp_path):
+    write_shapes(tmp_path)
+    index = SymbolIndex(tmp_path)
+    method = index.resolve('geometry.shapes:Square.area')
+    assert method['source_code'].startswith('def area(self):\n    def squared(n):')
+    assert (method['module'], method['name'], method['file_path']) == ('geometry.shapes', 'Square.area', tmp_path / 'geometry' / 'shapes.py')
+    assert index.resolve('Square.area.squared')['source_code'] == "def squared(n):\n    return n * n"
+    assert index.resolve('fetch')['is_async']
+    assert index.resolve('area')['qualified_name'] == 'geometry.shapes:area'
+    assert index.resolve('Circle', kind='function') is None
+    assert index.resolve('geometry.shapes:Missing') is None
+
+def test_symbol_index_ambiguous(tmp_path):
+    write_shapes(tmp_path)
+    (tmp_path / 'geometry' / 'lines.py').write_text("def area(line):\n    return 0\n")
+    with pytest.raises(AmbiguousSymbolError) as error:
+        extract_function_code(str(tmp_path), 'area')
+    assert error.value.candidates == ['geometry.lines:area', 'geometry.shapes:area']
+    assert isinstance(error.value, ValueError)
+    code, path = extract_function_code(str(tmp_path), 'geometry.lines:area')
+    assert code.startswith('def area(line):') and path.name == 'lines.py'
+    assert extract_function_code(str(tmp_path), 'Circle.area')[0] == "def area(self):\n    return 3"
+
+def test_symbol_index_stored_tables(tmp_path, monkeypatch):
+    write_shapes(tmp_path)
+    SymbolIndex(tmp_path)
+    assert not (tmp_path / '.klaradvn').exists()
+    cache_dir = tmp_path / 'cache'
+    SymbolIndex(tmp_path, cache_dir)
+    stored = json.loads((cache_dir / 'symbols.json').read_text())
+    assert stored['geometry/shapes.py']['symbols']['Square.area']['lineno'] > 1
+    assert 'source_code' not in stored['geometry/shapes.py']['symbols']['Square.area']
+
+    # A later process reads the unchanged files from the stored tables instead of parsing them
+    monkeypatch.setattr(extract, '_symbol_tables', {})
+    parsed = []
+    monkeypatch.setattr(extract, 'extract_symbols', lambda file_path, nested: parsed.append(file_path.name) or {})
+    (tmp_path / 'geometry' / 'circles.py').write_text("class Circle:\n    pass\n")
+    index = SymbolIndex(tmp_path, cache_dir)
+    assert parsed == ['circles.py']
+    method = index.resolve('Square.area')
+    assert method['module'] == 'geometry.shapes'
+    assert method['source_code'].startswith('def area(self):\n    def squared(n):')
+
+def test_extract_class_from_file(tmp_path):
+    write_shapes(tmp_path)
+    (tmp_path / 'geometry' / 'boxes.py').write_text("class Box:\n    class Lid:\n        def open(self):\n            pass\n")
+    result = extract_class(tmp_path / 'geometry' / 'boxes.py', 'Box.Lid')
+    assert result['instance_methods'] == ['open']
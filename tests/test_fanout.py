@@ -0,0 +1,124 @@
+from pathlib import Path
+
+from klaradvn.fanout import class_skeleton, merge_into_test_class
+from klaradvn.extract import extract_class
+
+PATH_PACKAGE = Path(__file__).parent / 'test-package'
+
+def test_class_skeleton():
+    result = extract_class(PATH_PACKAGE, 'CoolNewList')
+    assert class_skeleton(result['source_code'], keep='remove_element') == """@dataclass
+class CoolNewList:
+    elements: list[int]
+
+    def add_element(self, n: int):
+        ...
+
+    def remove_element(self, idx: int):
+        if idx > len(self.elements) - 1:
+            raise IndexError(f'List is only {len(self.elements)} long, the index you provided: {idx} does not exist')
+        self.elements.pop(idx)
+
+    def reverse(self):
+        ..."""
+
+def test_class_skeleton_keeps_init():
+    result = extract_class(PATH_PACKAGE, 'MyCustomObject')
+    skeleton = class_skeleton(result['source_code'])
+    assert "self.x = x" in skeleton
+    assert "self.x += shift" not in skeleton
+
+def test_merge_into_test_class():
+    add_element = """import pytest
+from package_one.amazing_class import CoolNewList
+
+@pytest.fixture
+def empty():
+    return CoolNewList([])
+
+def test_add(empty):
+    empty.add_element(1)
+    assert empty.elements == [1]
+"""
+    reverse = """import pytest
+
+class TestReverse:
+    def test_add(self):
+        assert True
+
+    def test_reverse(self):
+        l = CoolNewList([1, 2])
+        l.reverse()
+        assert l.elements == [2, 1]
+"""
+    assert merge_into_test_class([add_element, reverse, "not valid python ("], 'TestCoolNewList') == """import pytest
+from package_one.amazing_class import CoolNewList
+
+
+@pytest.fixture
+def empty():
+    return CoolNewList([])
+
+
+class TestCoolNewList:
+    def test_add(self, empty):
+        empty.add_element(1)
+        assert empty.elements == [1]
+
+    def test_add_2(self):
+        assert True
+
+    def test_reverse(self):
+        l = CoolNewList([1, 2])
+        l.reverse()
+        assert l.elements == [2, 1]
+"""
+
+def test_merge_into_test_class_renames_clashing_fixtures():
+    area = """import pytest
+
+@pytest.fixture
+def square():
+    return Square(2)
+
+def test_area(square):
+    assert square.area() == 4
+"""
+    side = area.replace("Square(2)", "Square(3)").replace("square.area() == 4", "square.side == 3").replace("test_area", "test_side")
+    merged = merge_into_test_class([area, side, area], 'TestSquare')
+    assert merged.count("def square():") == 1
+    assert "def square_2():\n    return Square(3)" in merged
+    assert "def test_side(self, square_2):\n        assert square_2.side == 3" in merged
+
+def test_merge_into_test_class_renames_only_symbols():
+    area = """import pytest
+
+@pytest.fixture
+def data():
+    return {"data": 2}
+
+def test_area(data):
+    assert Square(data["data"]).area() == 4
+"""
+    side = area.replace("2}", "3}").replace("area() == 4", "side == 3").replace("test_area", "test_side")
+    merged = merge_into_test_class([area, side], 'TestSquare')
+    assert "def data_2():\n    return {'data': 3}" in merged
+    assert "def test_side(self, data_2):\n        assert Square(data_2['data']).side == 3" in merged
+
+def test_merge_into_test_class_keeps_stateful_classes():
+    area = """class TestArea:
+    side = 2
+
+    def setup_method(self):
+        self.square = Square(self.side)
+
+    def test_area(self):
+        assert self.square.area() == 4
+"""
+    side = area.replace("2", "3").replace("area() == 4", "side == 3").replace("test_area", "test_side")
+    perimeter = "def test_perimeter():\n    assert Square(2).perimeter() == 8\n"
+    merged = merge_into_test_class([area, side, perimeter], 'TestSquare')
+    assert area.strip() in merged
+    assert "class TestArea_2:\n    side = 3\n\n    def setup_method(self):" in merged
+    assert "setup_method_2" not in merged
+    assert "class TestSquare:\n    def test_perimeter(self):" in merged
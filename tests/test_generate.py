@@ -2,8 +2,9 @@ from pathlib import Path
 import warnings
 import subprocess
 
+import pytest
 
-from klaradvn.generate import generate_tests
+from klaradvn.generate import generate_tests, assemble_structured_tests, extract_test_code
 from klaradvn.extract import extract_function_code, extract_class
 
 PATH_PACKAGE = Path(__file__).parent / 'test-package'
@@ -34,4 +35,31 @@ def test_generate_tests_class():
         if success:
             subprocess.run([f"pytest {test_path} --noconftest"], shell=True)
     except:
-        assert False
\ No newline at end of file
+        assert False
+
+def test_assemble_structured_tests():
+    response = """{"tests": [
+        {"name": "test_greater", "body": "assert another_function(1, 2)", "imports": ["import pytest"]},
+        {"name": "test_equal", "body": "def test_equal():\\n    assert not another_function(3, 3)", "imports": ["import pytest"]}
+    ]}"""
+    test_code = assemble_structured_tests(response)
+    assert test_code == """import pytest
+
+
+def test_greater():
+    assert another_function(1, 2)
+
+
+def test_equal():
+    assert not another_function(3, 3)
+"""
+
+def test_assemble_structured_tests_invalid():
+    with pytest.raises(ValueError):
+        assemble_structured_tests("not json")
+    with pytest.raises(ValueError):
+        assemble_structured_tests('{"tests": []}')
+
+def test_extract_test_code_unterminated_block():
+    response = "Here are the tests:\n```python\nimport pytest\n\ndef test_a():\n    assert True\n"
+    assert extract_test_code(response) == "import pytest\n\ndef test_a():\n    assert True"
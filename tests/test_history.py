@@ -0,0 +1,32 @@
+from klaradvn.history import load_runs, percentile, record_run, record_test_results, summarize_runs
+
+def test_record_run(tmp_path):
+    db_path = tmp_path / 'history.sqlite'
+    report = {'prompt_tokens': 120, 'output_tokens': 300, 'time_to_first_token': 0.5, 'total_latency': 4.0,
+              'validation': 'valid', 'tests': ['test_a', 'test_b'], 'prompt_hash': 'abc'}
+    run_id = record_run('another_function', "def another_function(): pass", report, db_path=db_path)
+    record_test_results(run_id, {'t::test_a': {'outcome': 'passed', 'duration': 0.1},
+                                 't::test_b': {'outcome': 'failed', 'duration': 0.2}}, db_path=db_path)
+    [run] = load_runs(db_path)
+    assert run['symbol'] == 'another_function'
+    assert (run['tests'], run['passed'], run['failed']) == (2, 1, 1)
+    assert abs(run['test_duration'] - 0.3) < 1e-9
+    assert run['prompt_hash'] == 'abc' and len(run['source_hash']) == 64
+    assert load_runs(db_path, symbol='other') == []
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile([1, 2, 3, 4], 90) == 3.7
+
+def test_summarize_runs_flags_regressions():
+    run = {'time_to_first_token': 1.0, 'total_latency': 10.0, 'prompt_tokens': 100, 'output_tokens': 200,
+           'test_duration': 1.0, 'validation': 'valid', 'passed': 3, 'failed': 0}
+    runs = [run] * 10 + [dict(run, total_latency=15.0, validation='invalid', passed=None)] * 5
+    summary = summarize_runs(runs, window=5, baseline=10)
+    assert summary['total_latency']['recent']['p50'] == 15.0
+    assert summary['total_latency']['baseline']['p50'] == 10.0
+    assert summary['total_latency']['regressed']
+    assert summary['valid_rate']['regressed']
+    assert summary['pass_rate']['recent']['p50'] is None and not summary['pass_rate']['regressed']
+    assert not summary['time_to_first_token']['regressed']
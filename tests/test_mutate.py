@@ -0,0 +1,65 @@
+import ast
+
+import pytest
+
+from klaradvn.mutate import generate_mutants, score_tests
+
+MODULE = '''def another_function(
+    n1: int,
+    n2: int
+):
+    """Docstrings are not mutated"""
+    return n2 > n1
+
+
+def untouched(a):
+    return a + 1
+'''
+
+WEAK_TESTS = '''from package_one.module import another_function
+
+def test_greater():
+    assert another_function(1, 2)
+'''
+
+STRONG_TESTS = WEAK_TESTS + '''
+def test_equal():
+    assert not another_function(3, 3)
+
+def test_smaller():
+    assert not another_function(2, 1)
+'''
+
+@pytest.fixture
+def package(tmp_path):
+    (tmp_path / 'package_one').mkdir()
+    (tmp_path / 'package_one' / '__init__.py').write_text('')
+    (tmp_path / 'package_one' / 'module.py').write_text(MODULE)
+    # Not named `tests`, which is already imported by the pytest process the workers fork from
+    (tmp_path / 'checks').mkdir()
+    return tmp_path
+
+def test_generate_mutants():
+    mutants = generate_mutants(MODULE, 1, 6)
+    assert [(m['lineno'], m['description']) for m in mutants] == [(6, '> -> >='), (6, '> -> <=')]
+    assert "return n2 >= n1" in ast.unparse(mutants[0]['tree'])
+    assert "return a + 1" in ast.unparse(mutants[0]['tree'])
+
+def test_score_tests(package):
+    test_file = package / 'checks' / 'test_mutated.py'
+    test_file.write_text(WEAK_TESTS)
+    args = ['--rootdir', str(package)]
+    weak = score_tests(package / 'package_one' / 'module.py', 1, 6, [str(test_file)], extra_args=args)
+    assert (weak['mutants'], weak['killed'], weak['survived']) == (2, 1, [(6, '> -> >=')])
+
+    test_file.write_text(STRONG_TESTS)
+    strong = score_tests(package / 'package_one' / 'module.py', 1, 6, [str(test_file)], extra_args=args)
+    assert strong['score'] == 1.0
+    # The code on disk is never touched
+    assert (package / 'package_one' / 'module.py').read_text() == MODULE
+
+def test_score_tests_failing_tests(package):
+    test_file = package / 'checks' / 'test_mutated.py'
+    test_file.write_text(WEAK_TESTS.replace("assert another_function", "assert not another_function"))
+    with pytest.raises(RuntimeError):
+        score_tests(package / 'package_one' / 'module.py', 1, 6, [str(test_file)], extra_args=['--rootdir', str(package)])
@@ -0,0 +1,39 @@
+from pathlib import Path
+
+from klaradvn.extract import extract_class
+from klaradvn.profiling import ProfileConfig, add_hook, configure, remove_hook, stage
+
+PATH_PACKAGE = Path(__file__).parent / 'test-package'
+
+def test_stage_reports(tmp_path):
+    reports = []
+    hook = lambda name, report: reports.append((name, report))
+    configure(ProfileConfig(profile=True, trace_memory=True, output_dir=tmp_path, top=5))
+    add_hook(hook)
+    try:
+        with stage('outer'):
+            with stage('inner') as inner:
+                data = [bytes(1000) for _ in range(100)]
+    finally:
+        remove_hook(hook)
+        configure(None)
+    assert inner == {}
+    assert [name for name, _ in reports] == ['outer']
+    report = reports[0][1]
+    assert len(report['hotspots']) == 5
+    assert report['peak_memory'] >= 100 * 1000
+    assert any('test_profiling.py' in a['location'] for a in report['allocations'])
+    assert report['report'].parent == tmp_path and report['report'].name.endswith('-outer.txt')
+    assert report['report'].with_suffix('.prof').exists()
+
+def test_stage_disabled():
+    with stage('extract') as report:
+        pass
+    assert report == {}
+
+def test_extract_class_executes_only_defining_modules(tmp_path):
+    (tmp_path / 'other.py').write_text("raise RuntimeError('executed')\n")
+    (tmp_path / 'shapes.py').write_text("class Square:\n    def area(self):\n        return 1\n")
+    result = extract_class(tmp_path, 'Square')
+    assert result['instance_methods'] == ['area']
+    assert extract_class(tmp_path, 'Circle') is None
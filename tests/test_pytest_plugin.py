@@ -0,0 +1,67 @@
+import os
+import sys
+import subprocess
+from pathlib import Path
+
+import klaradvn
+from klaradvn.pytest_plugin import package_roots, untested_symbols
+
+CONFTEST = """from pathlib import Path
+
+from klaradvn.pytest_plugin import collect_generated_tests
+
+TESTS = '''import pytest
+
+def test_ok():
+    assert add(1, 2) == 3
+
+@pytest.mark.parametrize('n', [1, 2])
+def test_bad(n):
+    assert add(1, n) == 4
+'''
+
+def pytest_collection_modifyitems(session, items):
+    items.extend(collect_generated_tests(session, Path('pkg/mod.py').resolve(), 'add', TESTS))
+"""
+
+def write_project(root):
+    (root / 'pkg').mkdir()
+    (root / 'pkg' / '__init__.py').write_text("")
+    (root / 'pkg' / 'mod.py').write_text("def add(a, b):\n    return a + b\n\ndef _private():\n    pass\n\nclass Counter:\n    pass\n")
+    (root / 'tests').mkdir()
+
+def test_untested_symbols(tmp_path):
+    write_project(tmp_path)
+    assert [name for _, _, name in untested_symbols([tmp_path])] == ['add', 'Counter']
+    (tmp_path / 'tests' / 'test_mod.py').write_text("from pkg.mod import add\n\ndef test_add():\n    assert add(1, 1) == 2\n")
+    [(code_file, code, name)] = untested_symbols([tmp_path])
+    assert (code_file, name) == (tmp_path / 'pkg' / 'mod.py', 'Counter')
+    assert code.startswith('class Counter:')
+
+def test_package_roots(tmp_path):
+    write_project(tmp_path)
+    (tmp_path / 'tests' / '__init__.py').write_text("")
+    (tmp_path / 'src' / 'other').mkdir(parents=True)
+    (tmp_path / 'src' / 'other' / '__init__.py').write_text("")
+    (tmp_path / 'conftest.py').write_text("def pytest_configure(config):\n    pass\n")
+    (tmp_path / 'setup.py').write_text("def build():\n    pass\n")
+    (tmp_path / 'script.py').write_text("def main():\n    pass\n")
+    assert package_roots(tmp_path) == [tmp_path / 'pkg', tmp_path / 'src' / 'other']
+    assert [name for _, _, name in untested_symbols([tmp_path])] == ['add', 'Counter', 'main']
+
+def test_collect_generated_tests_from_memory(tmp_path):
+    write_project(tmp_path)
+    (tmp_path / 'conftest.py').write_text(CONFTEST)
+    env = dict(os.environ, PYTHONPATH=str(Path(klaradvn.__file__).parent.parent))
+    result = subprocess.run([sys.executable, '-m', 'pytest', '-v', '-p', 'klaradvn.pytest_plugin', '-p', 'no:cacheprovider', '--klara-write'],
+                            cwd=tmp_path, env=env, capture_output=True, text=True)
+    assert 'tests/test_mod.add.py::test_ok PASSED' in result.stdout
+    assert 'tests/test_mod.add.py::test_bad[2] FAILED' in result.stdout
+    assert 'assert 3 == 4' in result.stdout
+    content = (tmp_path / 'tests' / 'test_mod.py').read_text()
+    assert 'def test_ok' in content and 'test_bad' not in content
+
+def test_plugin_does_not_import_klara():
+    code = "import sys, klaradvn.pytest_plugin; print(sorted(m for m in ('ollama', 'httpx', 'klaradvn.generate', 'klaradvn.history') if m in sys.modules))"
+    env = dict(os.environ, PYTHONPATH=str(Path(klaradvn.__file__).parent.parent))
+    assert subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True).stdout == "[]\n"
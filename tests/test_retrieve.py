@@ -0,0 +1,59 @@
+from klaradvn.retrieve import collect_tests, example_instructions, similar_tests, update_index
+
+TESTS = """import pytest
+
+@pytest.fixture
+def numbers():
+    return [1, 2, 3]
+
+def test_sum(numbers):
+    assert sum(numbers) == 6
+
+def test_upper():
+    assert "abc".upper() == "ABC"
+"""
+
+WORDS = ['sum', 'numbers', 'upper', 'abc']
+
+class CountingEmbedder:
+    """Embed texts as word counts and remember what was embedded."""
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(texts)
+        return [[text.count(word) for word in WORDS] for text in texts]
+
+def write_project(root):
+    (root / 'tests').mkdir()
+    (root / 'tests' / 'test_sample.py').write_text(TESTS)
+    (root / 'src').mkdir()
+    (root / 'src' / 'test_not_a_test_dir.py').write_text("def test_ignored():\n    pass\n")
+
+def test_collect_tests(tmp_path):
+    write_project(tmp_path)
+    assert list(collect_tests(tmp_path)) == ['tests/test_sample.py::test_sum', 'tests/test_sample.py::test_upper']
+
+def test_update_index_incremental(tmp_path):
+    write_project(tmp_path)
+    embed = CountingEmbedder()
+    index = update_index(tmp_path, embed=embed)
+    assert index['matrix'].shape == (2, len(WORDS))
+    assert (tmp_path / '.klaradvn' / 'test_index.npz').exists()
+
+    update_index(tmp_path, embed=embed)
+    assert len(embed.calls) == 1
+
+    with open(tmp_path / 'tests' / 'test_sample.py', 'a') as f:
+        f.write("\ndef test_lower():\n    assert \"ABC\".lower() == \"abc\"\n")
+    index = update_index(tmp_path, embed=embed)
+    assert len(embed.calls[-1]) == 1
+    assert list(index['keys'])[-1] == 'tests/test_sample.py::test_lower'
+
+def test_similar_tests(tmp_path):
+    write_project(tmp_path)
+    examples = similar_tests("def upper(s: str):\n    return s.upper()", tmp_path, k=1, embed=CountingEmbedder())
+    assert len(examples) == 1 and examples[0].startswith("def test_upper")
+    assert similar_tests("def upper(s): pass", tmp_path, k=2, token_budget=5, embed=CountingEmbedder()) == []
+    assert "def test_upper" in example_instructions(examples)
+    assert example_instructions([]) is None
@@ -0,0 +1,82 @@
+from klaradvn.runner import run_tests, apply_test_budget
+from klaradvn.sandbox import SandboxLimits
+
+TESTS = """import pytest
+
+def test_ok():
+    assert True
+
+def test_bad():
+    assert False
+
+@pytest.mark.parametrize('n', [1, 2])
+def test_param(n):
+    assert n
+
+class TestGroup:
+    def test_one(self):
+        assert True
+"""
+
+def test_run_tests_selected_and_cached(tmp_path):
+    test_file = tmp_path / 'test_sample.py'
+    test_file.write_text(TESTS)
+    node_ids = [f"{test_file}::{name}" for name in ['test_ok', 'test_bad', 'test_param', 'TestGroup']]
+
+    results = run_tests(node_ids[:3], "code", cache_dir=tmp_path / 'cache')
+    assert {n: r['outcome'] for n, r in results.items()} == {node_ids[0]: 'passed', node_ids[1]: 'failed', node_ids[2]: 'passed'}
+    assert not any(r['cached'] for r in results.values())
+
+    results = run_tests(node_ids, "code", cache_dir=tmp_path / 'cache')
+    assert [results[n]['cached'] for n in node_ids] == [True, True, True, False]
+    assert results[node_ids[3]]['outcome'] == 'passed'
+
+def test_run_tests_code_change_invalidates_cache(tmp_path):
+    test_file = tmp_path / 'test_sample.py'
+    test_file.write_text(TESTS)
+    node_ids = [f"{test_file}::test_ok"]
+    run_tests(node_ids, "code", cache_dir=tmp_path / 'cache')
+    assert not run_tests(node_ids, "changed code", cache_dir=tmp_path / 'cache')[node_ids[0]]['cached']
+
+def test_run_tests_fixture_change_invalidates_cache(tmp_path):
+    test_file = tmp_path / 'test_sample.py'
+    test_file.write_text(TESTS)
+    node_ids = [f"{test_file}::test_ok"]
+    run_tests(node_ids, "code", cache_dir=tmp_path / 'cache')
+    test_file.write_text(TESTS.replace("import pytest", "import pytest\n\n@pytest.fixture(autouse=True)\ndef fail():\n    assert False"))
+    assert not run_tests(node_ids, "code", cache_dir=tmp_path / 'cache')[node_ids[0]]['cached']
+    (tmp_path / 'conftest.py').write_text("")
+    assert not run_tests(node_ids, "code", cache_dir=tmp_path / 'cache')[node_ids[0]]['cached']
+
+SLOW_TESTS = """import time
+
+def test_fast():
+    assert True
+
+def test_slow():
+    time.sleep(0.5)
+
+def test_hanging():
+    time.sleep(60)
+"""
+
+def test_run_tests_sandbox_limits(tmp_path):
+    test_file = tmp_path / 'test_slow.py'
+    test_file.write_text(SLOW_TESTS)
+    node_ids = [f"{test_file}::{name}" for name in ['test_fast', 'test_slow', 'test_hanging']]
+    results = run_tests(node_ids, "code", cache_dir=tmp_path / 'cache', limits=SandboxLimits(timeout=2, test_budget=0.25))
+    assert [results[n]['outcome'] for n in node_ids] == ['passed', 'passed', 'timeout']
+    assert [results[n]['slow'] for n in node_ids] == [False, True, True]
+
+    assert apply_test_budget(results, 'reject') == node_ids[1:]
+    content = test_file.read_text()
+    assert "def test_fast" in content
+    assert "def test_slow" not in content and "def test_hanging" not in content
+
+def test_run_tests_rss_delta(tmp_path):
+    test_file = tmp_path / 'test_memory.py'
+    test_file.write_text("kept = []\n\ndef test_small():\n    assert True\n\ndef test_large():\n    kept.append(bytearray(b'x' * 64 * 2 ** 20))\n")
+    node_ids = [f"{test_file}::test_small", f"{test_file}::test_large"]
+    results = run_tests(node_ids, "code", cache_dir=tmp_path / 'cache')
+    assert results[node_ids[0]]['rss_delta'] < 16 * 2 ** 20
+    assert results[node_ids[1]]['rss_delta'] >= 60 * 2 ** 20
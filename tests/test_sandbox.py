@@ -0,0 +1,31 @@
+import sys
+import time
+
+import pytest
+
+from klaradvn.sandbox import SandboxLimits, run_sandboxed, resource
+
+def test_run_sandboxed():
+    result = run_sandboxed([sys.executable, '-c', 'x = bytearray(50 * 2 ** 20)'])
+    assert result['returncode'] == 0
+    assert not result['timed_out']
+    if resource:
+        assert result['peak_rss'] >= 50 * 2 ** 20
+
+def test_run_sandboxed_timeout_kills_process_group(tmp_path):
+    marker = tmp_path / 'survived'
+    grandchild = tmp_path / 'grandchild.py'
+    # The grandchild creates the marker file if it outlives the timeout
+    grandchild.write_text(f"import time\ntime.sleep(1)\nopen({str(marker)!r}, 'w')\n")
+    code = f"import subprocess, sys, time; subprocess.Popen([sys.executable, {str(grandchild)!r}]); time.sleep(60)"
+    result = run_sandboxed([sys.executable, '-c', code], SandboxLimits(timeout=0.5))
+    assert result['timed_out']
+    assert result['returncode'] is None
+    assert result['duration'] < 5
+    time.sleep(1.5)
+    assert not marker.exists()
+
+@pytest.mark.skipif(resource is None, reason="resource limits are not available on this platform")
+def test_run_sandboxed_memory_limit():
+    result = run_sandboxed([sys.executable, '-c', 'x = bytearray(1024 * 2 ** 20)'], SandboxLimits(memory_mb=256))
+    assert result['returncode'] != 0
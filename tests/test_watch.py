@@ -0,0 +1,60 @@
+import queue
+import threading
+from pathlib import Path
+
+import pytest
+
+from klaradvn import watch
+from klaradvn.extract import is_source_file
+from klaradvn.watch import _Inotify, _PollingWatcher, _worker
+
+def test_is_source_file(tmp_path):
+    assert is_source_file(tmp_path / 'package_one' / 'lorem_ipsum.py', tmp_path)
+    assert not is_source_file(tmp_path / 'tests' / 'helpers.py', tmp_path)
+    assert not is_source_file(tmp_path / 'package_one' / 'test_lorem_ipsum.py', tmp_path)
+    assert not is_source_file(tmp_path / '.venv' / 'module.py', tmp_path)
+    assert not is_source_file(tmp_path / 'README.md', tmp_path)
+
+def test_polling_watcher(tmp_path):
+    module = tmp_path / 'module.py'
+    module.write_text("def f():\n    return 1\n")
+    watcher = _PollingWatcher(tmp_path, interval=0.01)
+    assert watcher.wait(0.05) == set()
+    module.write_text("def f():\n    return 2\n")
+    # Bump the modification time in case the file system has a coarse resolution
+    module.touch()
+    (tmp_path / 'new.py').write_text("")
+    assert watcher.wait(1) == {module, tmp_path / 'new.py'}
+
+@pytest.mark.skipif(not _Inotify.available(), reason="inotify is only available on Linux")
+def test_inotify_watcher(tmp_path):
+    watcher = _Inotify(tmp_path)
+    try:
+        assert watcher.wait(0.05) == set()
+        (tmp_path / 'subpackage').mkdir()
+        watcher.wait(0.1)
+        (tmp_path / 'subpackage' / 'module.py').write_text("def f():\n    return 1\n")
+        (tmp_path / 'notes.txt').write_text("")
+        assert watcher.wait(1) == {tmp_path / 'subpackage' / 'module.py'}
+    finally:
+        watcher.close()
+
+def test_worker_survives_failed_job(monkeypatch, capsys):
+    generated = []
+
+    def generate_tests(file_path, code, name, report, cancel_event):
+        generated.append(name)
+        if name == 'broken':
+            raise SyntaxError("invalid syntax")
+        return False, file_path
+
+    monkeypatch.setattr(watch, 'generate_tests', generate_tests)
+    jobs, in_flight, lock = queue.Queue(), {}, threading.Lock()
+    for name in ['broken', 'fine']:
+        event = in_flight[(Path('module.py'), name)] = threading.Event()
+        jobs.put((Path('module.py'), name, "code", event))
+    threading.Thread(target=_worker, args=(jobs, in_flight, lock), daemon=True).start()
+    jobs.join()
+    assert generated == ['broken', 'fine']
+    assert in_flight == {}
+    assert "Generating the tests of broken in module.py failed" in capsys.readouterr().out
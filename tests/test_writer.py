@@ -0,0 +1,120 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from klaradvn.writer import GENERATED_MARKER, merge_tests, mark_tests, remove_tests, symbol_tests
+
+FIRST = """from package_one.lorem_ipsum import another_function
+
+import pytest
+
+def test_greater():
+    # n2 is larger
+    assert another_function(1, 2)
+
+def test_equal():
+    assert not another_function(3, 3)
+"""
+
+def test_merge_tests_new_file(tmp_path):
+    output_file = tmp_path / 'tests' / 'test_lorem_ipsum.py'
+    assert merge_tests(output_file, FIRST, 'another_function') == ['test_greater', 'test_equal']
+    content = output_file.read_text()
+    assert content.startswith("from package_one.lorem_ipsum import another_function\nimport pytest\n\n\n")
+    assert "    # n2 is larger\n" in content
+
+def test_merge_tests_replaces_stale_tests(tmp_path):
+    output_file = tmp_path / 'test_lorem_ipsum.py'
+    merge_tests(output_file, FIRST + "\ndef test_lorem():\n    assert lorem_ipsum()\n", 'another_function')
+    second = """from package_one.lorem_ipsum import another_function
+import pytest
+
+def test_smaller():
+    assert not another_function(2, 1)
+"""
+    assert merge_tests(output_file, second, 'another_function') == ['test_smaller']
+    content = output_file.read_text()
+    assert content.count("import another_function") == 1
+    assert content.count("import pytest") == 1
+    assert "test_lorem" in content
+    assert "test_greater" not in content
+
+def test_merge_tests_deduplicates_and_renames(tmp_path):
+    output_file = tmp_path / 'test_lorem_ipsum.py'
+    code = FIRST + """
+def test_greater_copy():
+    # n2 is larger
+    assert another_function(1, 2)
+
+def test_equal():
+    assert not another_function(-1, -1)
+"""
+    assert merge_tests(output_file, code, 'another_function') == ['test_greater', 'test_equal', 'test_equal_2']
+
+def test_merge_tests_keeps_handwritten_tests(tmp_path):
+    output_file = tmp_path / 'test_lorem_ipsum.py'
+    handwritten = "# Tests of the lorem ipsum module\nfrom package_one.lorem_ipsum import another_function\n\n\n# Regression test\ndef test_negative():\n    assert another_function(-2, -1)\n"
+    output_file.write_text(handwritten)
+    merge_tests(output_file, FIRST, 'another_function')
+    assert merge_tests(output_file, FIRST.replace("(1, 2)", "(5, 6)"), 'another_function') == ['test_greater', 'test_equal']
+    content = output_file.read_text()
+    assert content.startswith("# Tests of the lorem ipsum module\n")
+    assert "# Regression test\ndef test_negative():" in content
+    assert "another_function(1, 2)" not in content
+    assert content.count(GENERATED_MARKER) == 2
+
+def test_merge_tests_keeps_handwritten_fixtures(tmp_path):
+    output_file = tmp_path / 'test_lorem_ipsum.py'
+    output_file.write_text("import pytest\n\n\n@pytest.fixture\ndef data():\n    return [1, 2, 3]\n\n\ndef test_hand(data):\n    assert sum(data) == 6\n")
+    generated = "import pytest\n\n@pytest.fixture\ndef data():\n    return []\n\ndef test_empty(data):\n    assert another_function(data, {'data': 1})\n"
+    merge_tests(output_file, generated, 'another_function')
+    merge_tests(output_file, generated, 'another_function')
+    content = output_file.read_text()
+    assert "def data():\n    return [1, 2, 3]\n" in content
+    assert content.count("def data_2():\n    return []") == 1
+    assert "def test_empty(data_2):\n    assert another_function(data_2, {'data': 1})" in content
+    assert "def test_hand(data):" in content
+
+def test_merge_tests_without_tests(tmp_path):
+    output_file = tmp_path / 'test_lorem_ipsum.py'
+    output_file.write_text(FIRST)
+    with pytest.raises(ValueError):
+        merge_tests(output_file, "import pytest\n", 'another_function')
+    assert output_file.read_text() == FIRST
+
+def test_merge_tests_invalid_code(tmp_path):
+    output_file = tmp_path / 'test_lorem_ipsum.py'
+    output_file.write_text(FIRST)
+    with pytest.raises(SyntaxError):
+        merge_tests(output_file, "def test_(:\n", 'another_function')
+    assert output_file.read_text() == FIRST
+
+def test_merge_tests_concurrent(tmp_path):
+    output_file = tmp_path / 'test_module.py'
+    codes = [f"from module import f{i}\n\ndef test_f{i}():\n    assert f{i}()\n" for i in range(20)]
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda i: merge_tests(output_file, codes[i], f"f{i}"), range(20)))
+    content = output_file.read_text()
+    assert all(f"def test_f{i}():" in content for i in range(20))
+
+def test_remove_and_mark_tests(tmp_path):
+    output_file = tmp_path / 'test_lorem_ipsum.py'
+    output_file.write_text("from module import f\n\n\n@decorator\ndef test_a():\n    assert f()\n\n\nclass TestB:\n    def test_c(self):\n        assert f()\n\n\ndef test_d():\n    assert f()\n")
+    remove_tests(output_file, ['test_a'])
+    mark_tests(output_file, ['TestB', 'test_d'])
+    mark_tests(output_file, ['test_d'])
+    assert output_file.read_text() == "import pytest\nfrom module import f\n\n\n@pytest.mark.slow\nclass TestB:\n    def test_c(self):\n        assert f()\n\n\n@pytest.mark.slow\ndef test_d():\n    assert f()\n"
+
+def test_mark_tests_after_docstring_and_future_imports(tmp_path):
+    output_file = tmp_path / 'test_lorem_ipsum.py'
+    output_file.write_text('"""Tests of f."""\nfrom __future__ import annotations\n\nfrom module import f\n\n\ndef test_a():\n    assert f()\n')
+    mark_tests(output_file, ['test_a'])
+    content = output_file.read_text()
+    compile(content, str(output_file), 'exec')
+    assert content.startswith('"""Tests of f."""\nfrom __future__ import annotations\nimport pytest\n')
+
+def test_symbol_tests_qualified_name(tmp_path):
+    test_file = tmp_path / 'test_shapes.py'
+    test_file.write_text("from geometry.shapes import Square\n\ndef test_area():\n    assert Square(2).area() == 4\n\ndef test_side():\n    assert Square(2).side == 2\n")
+    assert symbol_tests(test_file, 'Square.area') == ['test_area']
+    assert symbol_tests(test_file, 'Square') == ['test_area', 'test_side']